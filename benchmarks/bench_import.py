@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from bingtiles.testing import HEAVY_MODULES, IMPORT_CASES
+
+CHILD = '''
+import sys, json, time, contextlib, io
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    exec(compile(sys.argv[1], '<case>', 'exec'))
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'modules': [m for m in sys.argv[2:] if m in sys.modules]}))
+'''
+
+
+def measure(statement, repeat=5):
+    """
+        Runs statement in repeat fresh interpreters.
+        :return: The best time in seconds and the heavy modules it imported.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    best, modules = float('inf'), []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', CHILD, statement, *HEAVY_MODULES], capture_output=True,
+                                text=True, env=env, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        best, modules = min(best, result['seconds']), result['modules']
+    return best, modules
+
+
+def main(repeat=5):
+    """
+        Times the import of the package and of its entry points, and lists the heavy dependencies each imports.
+        The import time budget and the allowed heavy modules are checked by tests/test_import.py.
+        :return: A dict of {name: {'seconds': seconds, 'modules': [...]}}.
+    """
+    results = {}
+    for name, (statement, _) in IMPORT_CASES.items():
+        seconds, modules = measure(statement, repeat)
+        results[name] = {'seconds': seconds, 'modules': modules}
+        print(f'{name:<10} {seconds * 1e3:9.2f} ms  {", ".join(modules) or "-"}')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import times of the package')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.repeat)
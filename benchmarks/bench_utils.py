@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+
+from bingtiles.utils import *
+from bingtiles.provider import providers, provider_urls
+
+
+def timeit(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def scalar_loop(func, *args):
+    return list(zip(*map(func, *args)))
+
+
+def report(results, name, t_scalar, t_vector):
+    results[name] = {'scalar': t_scalar, 'vector': t_vector}
+    if t_scalar is None:
+        print(f'{name:<24} {"":<19} vector {t_vector * 1e3:9.2f} ms')
+    else:
+        print(f'{name:<24} scalar {t_scalar * 1e3:9.2f} ms  vector {t_vector * 1e3:9.2f} ms  '
+              f'x{t_scalar / t_vector:6.1f}')
+
+
+def compare(results, name, scalar, vector, args, vector_args, exact=True):
+    t_scalar, expected = timeit(scalar_loop, scalar, *args)
+    t_vector, result = timeit(vector, *vector_args)
+    if exact:
+        for e, r in zip(expected, result):
+            r = np.broadcast_to(r, len(e))
+            assert np.array_equal(np.array(e, dtype=np.float64), r), f'{name} does not match the scalar path'
+    report(results, name, t_scalar, t_vector)
+
+
+def main(n=200000, lod=17):
+    """
+        Times the scalar and numpy variants of the coordinate and quadkey transforms on n random points.
+        :return: A dict of {name: {'scalar': seconds, 'vector': seconds}}.
+    """
+    results = {}
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-90, 90, n)
+    lon = rng.uniform(-190, 190, n)
+    lods = np.full(n, lod)
+    px, py, _ = geodetic2pixel_np(lat, lon, lod)
+    tx, ty, _ = pixel2tile(px, py, lod)
+    new_lods = np.full(n, lod - 3)
+
+    lat_l, lon_l, lods_l = lat.tolist(), lon.tolist(), lods.tolist()
+    px_l, py_l, tx_l, ty_l = px.tolist(), py.tolist(), tx.tolist(), ty.tolist()
+    new_lods_l = new_lods.tolist()
+
+    for exact in (True, False):
+        suffix = '' if exact else ' (fast)'
+        compare(results, 'geodetic2pixel' + suffix, geodetic2pixel, lambda *a: geodetic2pixel_np(*a, exact=exact),
+                (lat_l, lon_l, lods_l), (lat, lon, lod), exact)
+        compare(results, 'pixel2geodetic' + suffix, pixel2geodetic, lambda *a: pixel2geodetic_np(*a, exact=exact),
+                (px_l, py_l, lods_l), (px, py, lod), exact)
+        compare(results, 'geodetic2tile' + suffix, geodetic2tile, lambda *a: geodetic2tile_np(*a, exact=exact),
+                (lat_l, lon_l, lods_l), (lat, lon, lod), exact)
+        compare(results, 'tile2geodetic' + suffix, tile2geodetic, lambda *a: tile2geodetic_np(*a, exact=exact),
+                (tx_l, ty_l, lods_l), (tx, ty, lod), exact)
+    compare(results, 'pixel2pixel', pixel2pixel, pixel2pixel_np,
+            (px_l, py_l, lods_l, new_lods_l), (px, py, lod, lod - 3))
+    compare(results, 'tile2tile', tile2tile, tile2tile_np,
+            (tx_l, ty_l, lods_l, new_lods_l), (tx, ty, lod, lod - 3))
+
+    ix, iy = tx.astype(np.int64), ty.astype(np.int64)
+    ix_l, iy_l = ix.tolist(), iy.tolist()
+    t_scalar, expected = timeit(lambda: list(map(tile2quad, ix_l, iy_l, lods_l)))
+    t_vector, result = timeit(tile2quad_np, ix, iy, lod)
+    assert list(result) == expected, 'tile2quad_np does not match the scalar path'
+    report(results, 'tile2quad', t_scalar, t_vector)
+    t_scalar, _ = timeit(lambda: list(map(quad2tile, expected)))
+    t_vector, _ = timeit(quad2tile_np, expected)
+    report(results, 'quad2tile', t_scalar, t_vector)
+    t_vector, _ = timeit(tile2quadint, ix, iy, lod)
+    report(results, 'tile2quadint', None, t_vector)
+
+    # both start from an (N, 3) array, as the tile grids of mapgen and seed are
+    poses = np.stack([ix, iy, lods], axis=1)
+    for name in ('bing_aerial', 'esri_aerial', 'google_satellite'):
+        provider = providers[name]
+        t_scalar, _ = timeit(lambda: list(map(provider, map(tuple, poses.tolist()))))
+        t_vector, _ = timeit(provider_urls, provider, poses)
+        report(results, f'urls {name}', t_scalar, t_vector)
+    return results
+
+
+if __name__ == '__main__':
+    main()
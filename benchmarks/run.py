@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+from multiprocessing.dummy import Pool as ThreadPool
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bingtiles import *
+from bingtiles import metrics
+from bingtiles.mapgen import _tile_grid
+from bingtiles.provider import providers, default_google_versions
+from bingtiles.testing import TileServer
+import bench_utils
+import bench_import
+
+SCENARIOS = ['map_cold', 'map_warm', 'map_hot', 'map_processes', 'map_async', 'cache_fill', 'seed', 'providers',
+             'utils', 'imports']
+LAYOUTS = {'flat': 'flat', 'sharded': 'sharded', 'sqlite': 'cache.mbtiles'}
+
+
+class Benchmark:
+    """
+        Runs the scenarios against a local TileServer and collects their results.
+        Every scenario gets a fresh memory cache and its tile caches live in a temporary directory.
+    """
+
+    def __init__(self, args, server):
+        self.args = args
+        self.server = server
+        self.provider = server.provider(providers[args.providers[0]])
+        self.geo1 = tuple(args.bbox[:2])
+        self.geo2 = tuple(args.bbox[2:])
+        self.tmp = tempfile.mkdtemp(prefix='bingtiles-bench-')
+        self.fetcher = None
+        self.results = {}
+
+    def measure(self, name, func, tiles):
+        self.server.reset()
+        with metrics.collect() as aggregator:
+            start = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - start
+        result = {
+            'seconds': seconds,
+            'tiles': tiles,
+            'tiles_per_second': tiles / seconds,
+            'server': self.server.stats(),
+            'stages': aggregator.stats(),
+        }
+        self.results[name] = result
+        print(f'{name:<22} {seconds:8.3f} s  {tiles / seconds:10.1f} tiles/s  '
+              f'{result["server"]["requests"]:6d} requests')
+        return result
+
+    def cached_fetcher(self, name, layout='sharded', raw=False):
+        path = os.path.join(self.tmp, name, LAYOUTS[layout])
+        return CachedFetcher(path, self.provider, raw=raw, layout=None if layout == 'sqlite' else layout,
+                             memory_cache=MemoryCache())
+
+    def grid(self, lod=None):
+        tile_mn, tile_mx, _, _ = calculate_coverage(self.geo1, self.geo2, lod or self.args.lod)
+        return _tile_grid(tile_mn, tile_mx, lod or self.args.lod)
+
+    def generate(self, **kwargs):
+        return generate_map(self.geo1, self.geo2, self.args.lod, fetcher=self.fetcher, workers=self.args.workers,
+                            **kwargs)
+
+    def map_cold(self):
+        self.fetcher = self.cached_fetcher('map', raw=True)
+        self.measure('map_cold', self.generate, len(self.grid()))
+
+    def map_warm(self):
+        if self.fetcher is None:
+            self.map_cold()
+        self.fetcher.memory_cache.clear()
+        self.measure('map_warm', self.generate, len(self.grid()))
+
+    def map_hot(self):
+        if self.fetcher is None:
+            self.map_cold()
+        self.generate()
+        self.measure('map_hot', self.generate, len(self.grid()))
+
+    def map_processes(self):
+        if self.fetcher is None:
+            self.map_cold()
+        self.fetcher.memory_cache.clear()
+        self.measure('map_processes', lambda: self.generate(decode_workers=os.cpu_count()), len(self.grid()))
+
+    def map_async(self):
+        fetcher = self.cached_fetcher('async', raw=True)
+
+        def generate():
+            generator = MapGenerator(self.provider, fetcher, parallel=False)
+            asyncio.run(generator.agenerate_map(self.geo1, self.geo2, self.args.lod))
+
+        self.measure('map_async', generate, len(self.grid()))
+        fetcher.close()
+
+    def cache_fill(self):
+        poses = [tuple(pos) for pos in self.grid().tolist()]
+        for layout in LAYOUTS:
+            fetcher = self.cached_fetcher('fill', layout, raw=True)
+
+            def fill():
+                with ThreadPool(self.args.workers) as pool:
+                    pool.map(lambda pos: fetcher(pos, as_raw=True), poses)
+                fetcher.storage.flush()
+
+            self.measure(f'cache_fill_{layout}', fill, len(poses))
+            fetcher.close()
+
+    def seed(self):
+        fetcher = self.cached_fetcher('seed', raw=True)
+        min_lod = max(0, self.args.lod - 2)
+        tiles = sum(len(self.grid(lod)) for lod in range(min_lod, self.args.lod + 1))
+        self.measure('seed', lambda: seed(fetcher, [(self.geo1, self.geo2)], min_lod, self.args.lod,
+                                          workers=self.args.workers), tiles)
+        fetcher.close()
+
+    def providers(self):
+        poses = self.grid().tolist()
+        for name in self.args.providers:
+            provider = self.server.provider(providers[name])
+            memory_cache = MemoryCache()
+
+            def fetch():
+                with ThreadPool(self.args.workers) as pool:
+                    pool.map(lambda pos: fetch_tile(pos, provider, memory_cache=memory_cache), poses)
+
+            self.measure(f'fetch_{name}', fetch, len(poses))
+
+    def utils(self):
+        results = bench_utils.main(self.args.points)
+        for name, result in results.items():
+            self.results[f'utils_{name}'] = {'seconds': result['vector'], 'scalar_seconds': result['scalar']}
+
+    def imports(self):
+        for name, result in bench_import.main().items():
+            self.results[f'import_{name}'] = {'seconds': result['seconds'], 'modules': result['modules']}
+
+    def close(self):
+        if self.fetcher is not None:
+            self.fetcher.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(report, baseline):
+    for name, value in report['parameters'].items():
+        if name not in ('output', 'compare', 'scenarios') and baseline['parameters'].get(name) != value:
+            print(f'note: {name} was {baseline["parameters"].get(name)} in the baseline, now {value}')
+    print(f'\n{"scenario":<22} {"baseline s":>11} {"current s":>11} {"change":>8}')
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        change = result['seconds'] / old['seconds'] - 1
+        print(f'{name:<22} {old["seconds"]:11.3f} {result["seconds"]:11.3f} {change:+8.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks against a local stand-in tile server')
+    parser.add_argument('scenarios', nargs='*',
+                        help=f'scenarios to run, all of them by default ({", ".join(SCENARIOS)})')
+    parser.add_argument('-o', '--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('-c', '--compare', default=None, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--bbox', type=float, nargs=4, default=[41.02, 28.96, 40.98, 29.02],
+                        metavar=('LAT1', 'LON1', 'LAT2', 'LON2'))
+    parser.add_argument('-l', '--lod', type=int, default=17)
+    parser.add_argument('-w', '--workers', type=int, default=16)
+    parser.add_argument('--providers', nargs='+', choices=providers.keys(),
+                        default=['bing_aerial', 'esri_aerial', 'google_satellite'])
+    parser.add_argument('--latency', type=float, default=0.005, help='server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='uniform extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('--format', choices=['jpeg', 'png', 'webp'], default='jpeg')
+    parser.add_argument('--points', type=int, default=200000, help='points of the coordinate microbenchmarks')
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f'unknown scenario {scenario}')
+    scenarios = [s for s in SCENARIOS if s in args.scenarios] or SCENARIOS
+
+    # the benchmarks stay offline, so Google tile versions are not discovered
+    default_google_versions.background = False
+    with TileServer(args.latency, args.jitter, args.error_rate, args.format) as server:
+        benchmark = Benchmark(args, server)
+        try:
+            for scenario in scenarios:
+                getattr(benchmark, scenario)()
+        finally:
+            benchmark.close()
+
+    report = {'environment': environment(), 'parameters': vars(args), 'results': benchmark.results}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,49 @@
-from .utils import *
-from .fetch import fetch_tile, CachedFetcher
-from .provider import *
-from .mapgen import *
+from importlib import import_module
+
+from . import provider
+
+# submodules are imported on first attribute access, as numpy, PIL, requests and aiohttp
+# take far longer to import than most command line calls take to run
+_modules = {
+    'utils': ['EARTH_RADIUS', 'MIN_LATITUDE', 'MAX_LATITUDE', 'MIN_LONGITUDE', 'MAX_LONGITUDE', 'get_map_size',
+              'ground_resolution', 'map_scale', 'geodetic2pixel', 'pixel2geodetic', 'pixel2pixel', 'pixel2tile',
+              'tile2pixel', 'tile2tile', 'tile2geodetic', 'geodetic2tile', 'tile2quad', 'quad2tile', 'tile2quadint',
+              'quadint2tile', 'quadint2quad', 'quad2quadint', 'tile2quad_np', 'quad2tile_np', 'get_server_num',
+              'geodetic2pixel_np', 'pixel2geodetic_np', 'pixel2pixel_np', 'tile2tile_np', 'tile2geodetic_np',
+              'geodetic2tile_np'],
+    'session': ['SessionPool', 'default_session_pool'],
+    'metrics': ['MetricsAggregator'],
+    'memory': ['MemoryCache', 'default_memory_cache'],
+    'flight': ['SingleFlight', 'default_single_flight'],
+    'negative': ['NegativeCache', 'default_negative_cache', 'BING_NO_TILE'],
+    'retry': ['RetryPolicy', 'default_retry_policy'],
+    'ratelimit': ['RateLimiter', 'provider_rate_limiter', 'default_rate_limiter'],
+    'quota': ['CacheQuota'],
+    'storage': ['TileStorage', 'DirectoryStorage', 'ShardedStorage', 'SQLiteStorage', 'migrate_cache'],
+    'fetch': ['fetch_tile', 'CachedFetcher'],
+    'asyncfetch': ['AsyncFetcher'],
+    'mapgen': ['MapGenerator', 'generate_map', 'stream_map', 'calculate_coverage', 'split_map', 'iter_split_map',
+               'store_map'],
+    'pyramid': ['build_pyramid', 'FallbackFetcher'],
+    'seeding': ['seed', 'read_bboxes'],
+}
+
+_exports = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = [*_exports, *provider.__all__]
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        if name not in provider.__all__:
+            raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+        return getattr(provider, name)
+    submodule = import_module(f'.{module}', __name__)
+    for other in _modules[module]:
+        globals()[other] = getattr(submodule, other)
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
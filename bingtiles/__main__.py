@@ -1,25 +1,116 @@
-from bingtiles import *
-from bingtiles.provider import providers
-
+import math
 import argparse
 
+from bingtiles import metrics
+from bingtiles.provider import providers
+
 
 def main():
     parser = argparse.ArgumentParser(description='Small utility for accessing Bing Static Maps API')
-    parser.add_argument('command', choices=['tile', 'map'])
-    parser.add_argument('lat', type=float)
-    parser.add_argument('lon', type=float)
-    parser.add_argument('lat2', type=float, nargs='?')
-    parser.add_argument('lon2', type=float, nargs='?')
-    parser.add_argument('-l', '--lod', type=int, default=17)
-    parser.add_argument('-o', '--output', default=None)
-    parser.add_argument('-p', '--progress', action='store_true')
-    parser.add_argument('-z', '--cache-file', default=None)
-    parser.add_argument('-t', '--tile-provider', choices=providers.keys(), default='bing_hybrid')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-p', '--progress', action='store_true')
+    for command in ['tile', 'map']:
+        subparser = subparsers.add_parser(command, parents=[common])
+        subparser.add_argument('lat', type=float)
+        subparser.add_argument('lon', type=float)
+        subparser.add_argument('lat2', type=float, nargs='?')
+        subparser.add_argument('lon2', type=float, nargs='?')
+        subparser.add_argument('-l', '--lod', type=int, default=17)
+        subparser.add_argument('-o', '--output', default=None)
+        subparser.add_argument('-z', '--cache-file', default=None,
+                               help='tile cache, a directory or a single SQLite/MBTiles file (.mbtiles, .sqlite, .db)')
+        subparser.add_argument('-t', '--tile-provider', choices=providers.keys(), default='bing_hybrid')
+        if command == 'map':
+            subparser.add_argument('-d', '--decode-workers', type=int, default=None,
+                                   help='decode tiles in this many processes')
+    subparser = subparsers.add_parser('migrate', parents=[common],
+                                      help='convert a flat base64 cache into the sharded or SQLite layout')
+    subparser.add_argument('source')
+    subparser.add_argument('destination')
+    subparser.add_argument('-w', '--workers', type=int, default=None)
+    subparser.add_argument('--remove', action='store_true', help='remove migrated files from the source')
+    subparser.add_argument('-t', '--tile-provider', choices=providers.keys(), default=None,
+                           help='provider name for tiles whose provider can not be told from the URL')
+    subparser = subparsers.add_parser('seed', parents=[common],
+                                      help='download all tiles of one or more areas over a range of LODs')
+    subparser.add_argument('lat', type=float, nargs='?')
+    subparser.add_argument('lon', type=float, nargs='?')
+    subparser.add_argument('lat2', type=float, nargs='?')
+    subparser.add_argument('lon2', type=float, nargs='?')
+    subparser.add_argument('-f', '--bbox-file', default=None,
+                           help='file of bounding boxes, one "lat1 lon1 lat2 lon2" per line')
+    subparser.add_argument('-l', '--lod', type=int, default=17, help='highest level of detail')
+    subparser.add_argument('-m', '--min-lod', type=int, default=None, help='lowest level of detail')
+    subparser.add_argument('-w', '--workers', type=int, default=16)
+    subparser.add_argument('-c', '--checkpoint', default=None, help='checkpoint file to resume from')
+    subparser.add_argument('-r', '--rate', type=float, default=None,
+                           help='maximum requests per second to all tile servers of the provider together')
+    subparser.add_argument('--retries', type=int, default=3)
+    subparser.add_argument('--refresh', action='store_true',
+                           help='revalidate cached tiles with conditional requests and rewrite the changed ones')
+    subparser.add_argument('--max-age', type=float, default=None,
+                           help='with --refresh, skip tiles fetched or revalidated within this many seconds')
+    subparser.add_argument('-z', '--cache-file', required=True,
+                           help='tile cache, a directory or a single SQLite/MBTiles file (.mbtiles, .sqlite, .db)')
+    subparser.add_argument('-t', '--tile-provider', choices=providers.keys(), default='bing_hybrid')
     args = parser.parse_args()
+    if not args.progress:
+        return run(parser, args)
+    with metrics.collect() as aggregator:
+        try:
+            return run(parser, args)
+        finally:
+            if aggregator.stages:
+                print(aggregator.summary())
+
+
+def run(parser, args):
+    # only the modules a command needs are imported, to keep short calls short
+    if args.command == 'seed':
+        from bingtiles.seeding import seed, read_bboxes
+        from bingtiles.fetch import CachedFetcher
+        from bingtiles.retry import RetryPolicy
+        from bingtiles.ratelimit import RateLimiter, provider_rate_limiter
+        bboxes = []
+        if args.lat is not None:
+            if args.lat2 is None or args.lon2 is None:
+                parser.error('seed needs both corners of the area')
+            bboxes.append(((args.lat, args.lon), (args.lat2, args.lon2)))
+        if args.bbox_file is not None:
+            bboxes.extend(read_bboxes(args.bbox_file))
+        if not bboxes:
+            parser.error('seed needs an area or a --bbox-file')
+        min_lod = args.lod if args.min_lod is None else args.min_lod
+        provider = providers[args.tile_provider]
+        # providers spread tiles over several servers, the rate is for all of them together
+        rate_limiter = RateLimiter() if args.rate is None else provider_rate_limiter(provider, args.rate)
+        with CachedFetcher(args.cache_file, provider, raw=True, retry_policy=RetryPolicy(args.retries),
+                           rate_limiter=rate_limiter) as fetcher:
+            try:
+                stats = seed(fetcher, bboxes, min_lod, args.lod, workers=args.workers,
+                             checkpoint=args.checkpoint, progress=args.progress, refresh=args.refresh,
+                             max_age=args.max_age)
+            except ValueError as e:
+                parser.error(str(e))
+        summary = f'{stats["tiles"]} tiles: {stats["fetched"]} fetched, {stats["cached"]} cached, '
+        if args.refresh:
+            summary += f'{stats["unchanged"]} unchanged, {stats["changed"]} changed, '
+        print(f'{summary}{stats["failed"]} failed in {stats["seconds"]:.1f} s '
+              f'({stats["tiles_per_second"]:.1f} tiles/s, {stats["mb_per_second"]:.2f} MB/s)')
+        return
+    if args.command == 'migrate':
+        from bingtiles.storage import migrate_cache
+        migrated, skipped = migrate_cache(args.source, args.destination, workers=args.workers,
+                                          remove=args.remove, default_name=args.tile_provider,
+                                          progress=args.progress)
+        print(f'Migrated {migrated} tiles, skipped {skipped}')
+        return
+    from bingtiles.fetch import CachedFetcher
     provider = providers[args.tile_provider]
     fetcher = CachedFetcher(args.cache_file, provider)
     if args.command == 'tile':
+        from bingtiles.utils import geodetic2tile
         tile = geodetic2tile(args.lat, args.lon, args.lod)
         tile = tuple(map(math.floor, tile))
         img = fetcher(tile)
@@ -28,6 +119,7 @@ def main():
         else:
             img.save(args.output)
     elif args.command == 'map':
+        from bingtiles.mapgen import generate_map
         geo1 = (args.lat, args.lon)
         if args.lat2 is None:
             lat2 = args.lat
@@ -39,8 +131,13 @@ def main():
             lon2 = args.lon2
         geo2 = (lat2, lon2)
         img = generate_map(geo1, geo2,
-                           lod=args.lod, progress=args.progress, fetcher=fetcher)
+                           lod=args.lod, progress=args.progress, fetcher=fetcher,
+                           decode_workers=args.decode_workers)
         if args.output is None:
             img.show()
         else:
             img.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import os
+import time
+import asyncio
+import operator
+import requests
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .provider import default_provider, providers
+from .session import default_session_pool
+from .fetch import decode_image, read_image, response_meta
+from .memory import default_memory_cache
+from .negative import default_negative_cache
+from .retry import default_retry_policy
+from .ratelimit import default_rate_limiter
+from . import metrics
+
+
+class AsyncFetcher:
+    """
+        Fetches tiles with asyncio, keeping up to limit requests in flight and at most
+        per_host of them against each host (i.e. each tile server subdomain).
+        Uses aiohttp if it is installed, otherwise runs pooled requests sessions in threads.
+        If cache is a CachedFetcher, tiles are read from and written to its cache directory.
+    """
+
+    def __init__(self, provider=None, cache=None, per_host=8, limit=256, timeout=10, headers=None,
+                 session_pool=None, memory_cache=None, negative_cache=None, retry_policy=None, rate_limiter=None):
+        if provider is None:
+            provider = getattr(cache, 'provider', None) or providers[default_provider]
+        self.provider = provider
+        self.cache = cache
+        self.per_host = per_host
+        self.limit = limit
+        self.timeout = timeout
+        self.headers = headers
+        if session_pool is None:
+            session_pool = getattr(cache, 'session_pool', None) or default_session_pool
+        self.session_pool = session_pool
+        if memory_cache is None:
+            memory_cache = getattr(cache, 'memory_cache', None)
+            if memory_cache is None:
+                memory_cache = default_memory_cache
+        self.memory_cache = memory_cache
+        if negative_cache is None:
+            negative_cache = getattr(cache, 'negative_cache', None)
+            if negative_cache is None:
+                negative_cache = default_negative_cache
+        self.negative_cache = negative_cache
+        if retry_policy is None:
+            retry_policy = getattr(cache, 'retry_policy', None) or default_retry_policy
+        self.retry_policy = retry_policy
+        if rate_limiter is None:
+            rate_limiter = getattr(cache, 'rate_limiter', None) or default_rate_limiter
+        self.rate_limiter = rate_limiter
+        self.session = None
+        self.executor = None
+        self.semaphore = None
+        self.semaphores = {}
+
+    async def __call__(self, pos, provider=None, only_cached=False, as_array=False, key=None):
+        """
+            :param key: Key of the tile in the storage of cache if already known, e.g. from keys().
+        """
+        if provider is None:
+            provider = self.provider
+        # numpy integers, e.g. from rows of a tile grid, are rejected by tile2quad
+        pos = tuple(map(operator.index, pos))
+        loop = asyncio.get_running_loop()
+        memory_key = (provider, pos) if self.cache is None else (self.cache.storage, provider, pos)
+        image = self.memory_cache.get(memory_key)
+        if metrics.listeners:
+            metrics.emit('cache.memory', hit=image is not None)
+        if image is None:
+            image = await self._fetch(loop, pos, provider, only_cached, key)
+            if image is None:
+                return None
+            self.memory_cache.put(memory_key, image)
+        if not as_array:
+            image = Image.fromarray(image)
+        return image
+
+    async def _fetch(self, loop, pos, provider, only_cached, key):
+        if self.cache is not None:
+            if key is None:
+                key = self.cache.key(pos, provider)
+            cached = await loop.run_in_executor(None, self.cache.get_raw, pos, provider, key)
+            if cached is not None:
+                return await loop.run_in_executor(None, decode_image, cached[0])
+        if only_cached:
+            return None
+        url = provider(pos)
+        if os.path.exists(url):
+            return await loop.run_in_executor(None, read_image, url)
+        content, headers = await self._download(url, key)
+        return await loop.run_in_executor(None, self._decode, pos, provider, content, headers)
+
+    fetch = __call__
+
+    def keys(self, poses, provider=None):
+        """
+            :return: The storage keys of the tiles in the cache, built in one batch, or Nones without a cache.
+        """
+        if self.cache is None:
+            return [None] * len(poses)
+        return self.cache.keys(poses, provider or self.provider)
+
+    async def fetch_many(self, poses, provider=None, only_cached=False, as_array=False, progress=False):
+        if not hasattr(poses, '__len__'):
+            poses = list(poses)
+        keys = self.keys(poses, provider)
+        coros = [self(pos, provider, only_cached, as_array, key) for pos, key in zip(poses, keys)]
+        if progress:
+            from tqdm.asyncio import tqdm_asyncio
+            return await tqdm_asyncio.gather(*coros)
+        return await asyncio.gather(*coros)
+
+    async def download(self, url, key=None):
+        """
+            :param key: Key of the tile in the negative cache, defaults to its URL.
+        """
+        content, headers = await self._download(url, key)
+        return content, headers.get('Content-Type')
+
+    async def _download(self, url, key=None):
+        if key is None:
+            key = url
+        status = self.negative_cache.get(key)
+        if status is not None:
+            raise ValueError(f'Tile from {url} is unavailable ({status})')
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        host = urlsplit(url).netloc
+        semaphore = self.semaphores.get(host)
+        if semaphore is None:
+            semaphore = self.semaphores[host] = asyncio.Semaphore(self.per_host)
+        async with self.semaphore, semaphore:
+            status, content, headers = await self._request(url)
+        negative = self.negative_cache.classify(status, content, headers)
+        if negative is not None:
+            self.negative_cache.put(key, negative)
+            raise ValueError(f'Tile from {url} is unavailable ({negative})')
+        return content, headers
+
+    async def _request(self, url):
+        if aiohttp is None:
+            download, errors = self._download_threaded, (requests.ConnectionError, requests.Timeout)
+        else:
+            download, errors = self._download_aiohttp, (aiohttp.ClientError, asyncio.TimeoutError)
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.acquire(url)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            start = time.perf_counter() if metrics.listeners else None
+            try:
+                status, content, headers = await download(url)
+            except errors:
+                if start is not None:
+                    metrics.emit('fetch.network', time.perf_counter() - start, status=None)
+                if not self.retry_policy.should_retry(attempt):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+            else:
+                if start is not None:
+                    metrics.emit('fetch.network', time.perf_counter() - start, status=status, bytes=len(content))
+                if not self.retry_policy.should_retry(attempt, status):
+                    return status, content, headers
+                retry_after = headers.get('Retry-After')
+                delay = self.retry_policy.delay(attempt, retry_after)
+                if delay is None:
+                    return status, content, headers
+                if retry_after is not None or status == 429:
+                    self.rate_limiter.pause(url, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _download_aiohttp(self, url):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.per_host)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+        async with self.session.get(url) as r:
+            return r.status, await r.read(), r.headers
+
+    async def _download_threaded(self, url):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.limit)
+            self.session_pool.resize(self.per_host)
+        get = partial(self.session_pool.get, url, timeout=self.timeout, headers=self.headers)
+        r = await asyncio.get_running_loop().run_in_executor(self.executor, get)
+        return r.status_code, r.content, r.headers
+
+    def _decode(self, pos, provider, content, headers):
+        image = decode_image(content)
+        if self.cache is not None:
+            if self.cache.raw:
+                self.cache.store_raw(pos, content, headers.get('Content-Type'), provider, response_meta(headers))
+            else:
+                self.cache.store(pos, Image.fromarray(image), provider, response_meta(headers))
+        return image
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.semaphore = None
+        self.semaphores = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
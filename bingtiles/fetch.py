@@ -1,106 +1,414 @@
 import io
 import os
+import time
+import shutil
 import tempfile
-import base64
-import functools
 
-import requests
 from PIL import Image
 import numpy as np
-
-try:
-    import cv2
-except ImportError:
-    cv2 = None
+import requests
 
 from .provider import default_provider, providers
+from .storage import DirectoryStorage, open_storage
+from .session import default_session_pool
+from .memory import default_memory_cache
+from .flight import default_single_flight
+from .negative import NegativeCache, default_negative_cache
+from .retry import default_retry_policy
+from .ratelimit import default_rate_limiter
+from . import metrics
+from .quota import CacheQuota
 
 
-@functools.lru_cache(maxsize=1024)
-def fetch_tile(pos, provider=None, as_array=False):
+def fetch_tile(pos, provider=None, as_array=False, session_pool=None, memory_cache=None, single_flight=None,
+               negative_cache=None, retry_policy=None, rate_limiter=None):
     if provider is None:
-        provider = default_provider
+        provider = providers[default_provider]
+    if session_pool is None:
+        session_pool = default_session_pool
+    if memory_cache is None:
+        memory_cache = default_memory_cache
+    if single_flight is None:
+        single_flight = default_single_flight
+    if negative_cache is None:
+        negative_cache = default_negative_cache
+    pos = tuple(pos)
+    image = memory_cache.get((provider, pos))
+    if metrics.listeners:
+        metrics.emit('cache.memory', hit=image is not None)
+    if image is None:
+        image = single_flight.do((provider, pos), load_tile, pos, provider, session_pool, negative_cache,
+                                 retry_policy=retry_policy, rate_limiter=rate_limiter)
+        memory_cache.put((provider, pos), image)
+    if not as_array:
+        image = Image.fromarray(image)
+    return image
+
+
+def load_tile(pos, provider, session_pool=None, negative_cache=None, key=None, retry_policy=None, rate_limiter=None):
     url = provider(pos)
     if os.path.exists(url):
-        try:
-            image = cv2.imread(url, cv2.IMREAD_UNCHANGED)
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            if not as_array:
-                image = Image.fromarray(image)
-            return image
-        except:
-            image = Image.open(url)
-            if as_array:
-                image = np.array(image)
-            return image
-    r = requests.get(url)
+        return read_image(url)
+    content, _ = download_tile(pos, provider, session_pool, negative_cache, key, retry_policy, rate_limiter)
+    return decode_image(content)
+
+
+def download_tile(pos, provider=None, session_pool=None, negative_cache=None, key=None, retry_policy=None,
+                  rate_limiter=None):
+    """
+        :param negative_cache: NegativeCache to skip tiles known to be unavailable and to record new ones in.
+        :param key: Key of the tile in negative_cache, defaults to its URL.
+        :param retry_policy: RetryPolicy for failed requests, defaults to default_retry_policy.
+        :param rate_limiter: RateLimiter to throttle requests with, defaults to default_rate_limiter.
+    """
+    if provider is None:
+        provider = providers[default_provider]
+    r = _download(pos, provider, session_pool, negative_cache, key, retry_policy, rate_limiter)
+    return r.content, r.headers.get('Content-Type')
+
+
+def _download(pos, provider, session_pool, negative_cache, key, retry_policy, rate_limiter, meta=None):
+    # with the validators of meta the request is conditional, and a 304 response is returned as is
+    url = provider(pos)
+    if negative_cache is not None:
+        if key is None:
+            key = url
+        status = negative_cache.get(key)
+        if status is not None:
+            raise ValueError(f'Tile {pos} from {url} is unavailable ({status})')
+    headers = conditional_headers(meta) if meta is not None else None
+    r = request_tile(url, session_pool, retry_policy, rate_limiter, headers)
+    if r.status_code == 304 and headers:
+        return r
+    if negative_cache is not None:
+        status = negative_cache.classify(r.status_code, r.content, r.headers)
+        if status is not None:
+            negative_cache.put(key, status)
+            raise ValueError(f'Tile {pos} from {url} is unavailable ({status})')
     if r.status_code != 200:
         raise ValueError(f'Failed to download tile {pos} from {url}')
-    byts = io.BytesIO(r.content)
-    image = Image.open(byts)
-    if as_array:
-        image = np.array(image)
-    return image
+    return r
+
+
+def conditional_headers(meta):
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def response_meta(headers):
+    """
+        :return: The tile metadata (validators and fetch time) of a response with the given headers.
+    """
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'), 'fetched': time.time()}
+
+
+def request_tile(url, session_pool=None, retry_policy=None, rate_limiter=None, headers=None):
+    """
+        GETs url under the rate limiter, retrying connection errors and retryable statuses.
+        :return: The last response.
+    """
+    if session_pool is None:
+        session_pool = default_session_pool
+    if retry_policy is None:
+        retry_policy = default_retry_policy
+    if rate_limiter is None:
+        rate_limiter = default_rate_limiter
+    attempt = 0
+    while True:
+        rate_limiter.wait(url)
+        start = time.perf_counter() if metrics.listeners else None
+        try:
+            r = session_pool.get(url, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            if start is not None:
+                metrics.emit('fetch.network', time.perf_counter() - start, status=None)
+            if not retry_policy.should_retry(attempt):
+                raise
+            delay = retry_policy.delay(attempt)
+        else:
+            if start is not None:
+                metrics.emit('fetch.network', time.perf_counter() - start, status=r.status_code, bytes=len(r.content))
+            if not retry_policy.should_retry(attempt, r.status_code):
+                return r
+            retry_after = r.headers.get('Retry-After')
+            delay = retry_policy.delay(attempt, retry_after)
+            if delay is None:
+                return r
+            if retry_after is not None or r.status_code == 429:
+                rate_limiter.pause(url, delay)
+        attempt += 1
+        time.sleep(delay)
+
+
+def to_array(image):
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        if image.mode in ('LA', 'PA', 'RGBa') or 'transparency' in image.info:
+            image = image.convert('RGBA')
+        else:
+            image = image.convert('RGB')
+    return np.array(image)
+
+
+_cv2 = False
+
+
+def load_cv2():
+    """
+        Imports OpenCV on first use, as it takes longer to import than the rest of the package.
+        :return: The cv2 module, or None if it is not installed.
+    """
+    global _cv2
+    if _cv2 is False:
+        try:
+            import cv2
+        except ImportError:
+            cv2 = None
+        _cv2 = cv2
+    return _cv2
+
+
+def read_image(path):
+    cv2 = load_cv2()
+    try:
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return image
+    except:
+        return to_array(Image.open(path))
+
+
+def decode_image(content):
+    cv2 = load_cv2()
+    try:
+        image = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_UNCHANGED)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return image
+    except:
+        return to_array(Image.open(io.BytesIO(content)))
 
 
 class CachedFetcher:
-    def __init__(self, cache_path=None, provider=None):
+    def __init__(self, cache_path=None, provider=None, session_pool=None, raw=False, storage=None, layout=None,
+                 memory_cache=None, max_bytes=None, max_tiles=None, eviction='lru', single_flight=None,
+                 negative_cache=None, retry_policy=None, rate_limiter=None):
+        self.closed = False
+        self.quota = None
         self.cache_path = cache_path
-        self.tmp = cache_path is None
-        if self.tmp:
-            self.cache_path = tempfile.mkdtemp()
-        else:
-            if not os.path.exists(self.cache_path):
-                os.makedirs(self.cache_path)
+        self.tmp = cache_path is None and storage is None
+        if storage is None:
+            if self.tmp:
+                self.cache_path = tempfile.mkdtemp()
+                storage = DirectoryStorage(self.cache_path)
+            else:
+                storage = open_storage(self.cache_path, layout)
+        self.storage = storage
         if provider is None:
             provider = providers[default_provider]
         self.provider = provider
-        self.__call__ = functools.lru_cache(maxsize=1024)(self.__call__)
+        if session_pool is None:
+            session_pool = default_session_pool
+        self.session_pool = session_pool
+        self.raw = raw
+        if memory_cache is None:
+            memory_cache = default_memory_cache
+        self.memory_cache = memory_cache
+        if single_flight is None:
+            single_flight = default_single_flight
+        self.single_flight = single_flight
+        if negative_cache is None:
+            negative_path = None
+            if not self.tmp and self.cache_path is not None:
+                negative_path = self.cache_path.rstrip('/\\') + '.negative'
+            negative_cache = NegativeCache(negative_path)
+        self.negative_cache = negative_cache
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        if max_bytes is not None or max_tiles is not None:
+            self.quota = CacheQuota(self.storage, max_bytes, max_tiles, policy=eviction)
 
-    def __call__(self, pos, provider=None, only_cached=False, as_array=False):
+    def __call__(self, pos, provider=None, only_cached=False, as_array=False, as_raw=False, key=None):
+        """
+            :param key: Storage key of the tile if already known, e.g. from keys().
+        """
         if provider is None:
             provider = self.provider
-        url = provider(pos)
-        file_name = base64.urlsafe_b64encode(url.encode('utf-8')).decode('utf-8')
-        file_name += '.png'
-        file_path = os.path.join(self.cache_path, file_name)
-        if os.path.exists(file_path):
-            image = self.read_image(file_path)
-            if not as_array:
-                image = Image.fromarray(image)
-            return image
-        elif not only_cached:
-            pos = tuple(pos)
-            image = fetch_tile(pos, provider)
-            with open(file_path, 'wb') as f:
-                image.save(f, format='png')
-            if as_array:
-                image = np.array(image)
-            return image
+        pos = tuple(pos)
+        memory_key = (self.storage, provider, pos)
+        image = None if as_raw else self.memory_cache.get(memory_key)
+        if metrics.listeners and not as_raw:
+            metrics.emit('cache.memory', hit=image is not None)
+        if image is None:
+            if key is None:
+                key = self.key(pos, provider)
+            cached = self.get_raw(pos, provider, key)
+            if cached is not None:
+                content, _ = cached
+            elif only_cached:
+                return None
+            else:
+                raw = self.raw or as_raw
+                content, image = self.single_flight.do(
+                    (self.storage, provider, pos, raw), self._load, pos, provider, raw, key)
+            if as_raw:
+                return content
+            if image is None:
+                start = time.perf_counter() if metrics.listeners else None
+                image = self.decode(content)
+                if start is not None:
+                    metrics.emit('cache.decode', time.perf_counter() - start)
+            self.memory_cache.put(memory_key, image)
+        if not as_array:
+            image = Image.fromarray(image)
+        return image
+
+    def _load(self, pos, provider, raw, key):
+        # checked again as a concurrent call may have stored the tile in the meantime
+        cached = self.storage.get(key)
+        if cached is not None:
+            return cached[0], None
+        if not raw and os.path.exists(provider(pos)):
+            image = read_image(provider(pos))
+            self.store(pos, Image.fromarray(image), provider)
+            return None, image
+        r = _download(pos, provider, self.session_pool, self.negative_cache, key, self.retry_policy,
+                      self.rate_limiter)
+        meta = response_meta(r.headers)
+        if raw:
+            self.store_raw(pos, r.content, r.headers.get('Content-Type'), provider, meta)
+            return r.content, None
+        image = decode_image(r.content)
+        self.store(pos, Image.fromarray(image), provider, meta)
+        return None, image
+
+    def refresh(self, pos, provider=None, max_age=None):
+        """
+            Revalidates a cached tile with a conditional request on its ETag / Last-Modified validators,
+            and rewrites it only if it changed. Tiles that are not cached yet are fetched.
+            :param max_age: Seconds since the tile was fetched or revalidated within which it is left as is.
+            :return: 'fresh' (within max_age), 'unchanged', 'changed' or 'fetched'.
+        """
+        if provider is None:
+            provider = self.provider
+        pos = tuple(pos)
+        key = self.key(pos, provider)
+        meta = self.storage.get_meta(key)
+        if meta is None:
+            self(pos, provider, as_raw=self.raw, as_array=True)
+            return 'fetched'
+        fetched = meta.get('fetched')
+        if max_age is not None and fetched is not None and time.time() - fetched < max_age:
+            return 'fresh'
+        r = _download(pos, provider, self.session_pool, self.negative_cache, key,
+                      self.retry_policy, self.rate_limiter, meta)
+        new_meta = response_meta(r.headers)
+        if r.status_code == 304:
+            # a 304 may leave out the validators that did not change
+            for name in ('etag', 'last_modified'):
+                if new_meta[name] is None:
+                    new_meta[name] = meta.get(name)
+            self.storage.put_meta(key, new_meta)
+            return 'unchanged'
+        if self.raw:
+            content, content_type = r.content, r.headers.get('Content-Type')
         else:
-            return None
+            f = io.BytesIO()
+            Image.fromarray(decode_image(r.content)).save(f, format='png')
+            content, content_type = f.getvalue(), 'image/png'
+        cached = self.storage.get(key)
+        if cached is not None and cached[0] == content:
+            self.storage.put_meta(key, new_meta)
+            return 'unchanged'
+        self.store_raw(pos, content, content_type, provider, new_meta)
+        return 'changed'
 
-    def fetch(self, pos, provider=None, only_cached=False, as_array=False):
+    def fetch(self, pos, provider=None, only_cached=False, as_array=False, as_raw=False):
         if provider is None:
             provider = self.provider
-        return self(pos, provider, only_cached, as_array)
+        return self(pos, provider, only_cached, as_array, as_raw)
+
+    def key(self, pos, provider=None):
+        if provider is None:
+            provider = self.provider
+        return self.storage.key(provider, pos)
+
+    def keys(self, poses, provider=None):
+        """
+            Batch version of key, building all URLs at once where the storage needs them.
+            :param poses: Array-like of shape (N, 3) of tile positions, e.g. from _tile_grid.
+        """
+        if provider is None:
+            provider = self.provider
+        return self.storage.keys(provider, poses)
+
+    def get_raw(self, pos, provider=None, key=None):
+        if key is None:
+            key = self.key(pos, provider)
+        start = time.perf_counter() if metrics.listeners else None
+        cached = self.storage.get(key)
+        if start is not None:
+            metrics.emit('cache.read', time.perf_counter() - start, hit=cached is not None,
+                         bytes=0 if cached is None else len(cached[0]))
+        if cached is not None and self.quota is not None:
+            self.quota.touch(key)
+        return cached
+
+    def contains(self, pos, provider=None, key=None):
+        if key is None:
+            key = self.key(pos, provider)
+        return self.storage.contains(key)
+
+    def is_unavailable(self, pos, provider=None):
+        return self.negative_cache.get(self.key(pos, provider)) is not None
+
+    def meta(self, pos, provider=None):
+        return self.storage.get_meta(self.key(pos, provider))
+
+    def store(self, pos, image, provider=None, meta=None):
+        f = io.BytesIO()
+        image.save(f, format='png')
+        self.store_raw(pos, f.getvalue(), 'image/png', provider, meta)
+
+    def store_raw(self, pos, content, content_type=None, provider=None, meta=None):
+        if provider is None:
+            provider = self.provider
+        pos = tuple(pos)
+        key = self.key(pos, provider)
+        start = time.perf_counter() if metrics.listeners else None
+        self.storage.put(key, content, content_type, meta)
+        if start is not None:
+            metrics.emit('cache.store', time.perf_counter() - start, bytes=len(content))
+        if self.quota is not None:
+            self.quota.add(key, len(content))
+        # a rewritten tile (refresh, build_pyramid with overwrite) must not be served from memory
+        self.memory_cache.discard((self.storage, provider, pos))
 
     def close(self):
-        if self.tmp and os.path.exists(self.cache_path):
-            os.rmdir(self.cache_path)
+        if self.closed:
+            return
+        self.closed = True
+        # the tiles of this storage are keyed on it, which would keep it alive in a shared memory cache
+        if getattr(self, 'memory_cache', None) is not None:
+            self.memory_cache.discard_if(lambda key: key[0] is self.storage)
+        if self.quota is not None:
+            self.quota.close()
+        self.negative_cache.close()
+        self.storage.close()
+        if self.tmp:
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+
+    def decode(self, content):
+        return decode_image(content)
 
     def read_image(self, path):
-        try:
-            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            return image
-        except:
-            image = Image.open(path)
-            image = np.array(image)
-            return image
+        return read_image(path)
 
     def __del__(self):
-        self.close()
+        if hasattr(self, 'storage'):
+            self.close()
 
     def __enter__(self):
         return self
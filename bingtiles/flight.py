@@ -0,0 +1,55 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+        Coalesces concurrent calls for the same key. The first caller runs the function while later callers
+        wait for it and share its result, or its exception. Once the call returns, the key is free again.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    __call__ = do
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __contains__(self, key):
+        return key in self.calls
+
+
+default_single_flight = SingleFlight()
@@ -1,32 +1,54 @@
+import io
+import os
+import time
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+
 import numpy as np
 from PIL import Image
 from multiprocessing.dummy import Pool as ThreadPool
-from tqdm import tqdm
-from functools import lru_cache
-
-try:
-    import cv2
-except ImportError:
-    cv2 = None
+from functools import lru_cache, partial
+from itertools import count, repeat
 
 from .utils import geodetic2tile
-from .fetch import fetch_tile
+from .fetch import fetch_tile, decode_image, load_cv2, CachedFetcher
+from .storage import TileStorage, DirectoryStorage, ShardedStorage
+from .session import default_session_pool
+from . import metrics
 
 
 class MapGenerator:
-    def __init__(self, provider=None, fetcher=None, progress=False, parallel=True, multifetch=False):
+    def __init__(self, provider=None, fetcher=None, progress=False, parallel=True, multifetch=False,
+                 workers=None, session_pool=None, decode_workers=None, decode_chunk=16):
         self.provider = provider
         self.fetcher = fetcher
         self.progress = progress
         self.parallel = parallel
         self.multifetch = multifetch
         self.pool = None
+        self.decode_pool = None
+        self.decode_chunk = decode_chunk
         if self.multifetch and self.parallel:
             raise ValueError("multifetch and parallel cannot be used together")
+        if decode_workers:
+            if not isinstance(self.fetcher, CachedFetcher):
+                raise ValueError("decode_workers requires a CachedFetcher")
+            # workers are started from a fresh process rather than forked from this one, whose threads
+            # (fetch pools, a CacheQuota eviction thread) may hold locks at the time of the fork
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self.decode_pool = context.Pool(decode_workers)
+        if session_pool is None:
+            session_pool = getattr(self.fetcher, 'session_pool', None) or default_session_pool
+        self.session_pool = session_pool
         if self.fetcher is None:
-            self.fetcher = fetch_tile
+            self.fetcher = partial(fetch_tile, session_pool=self.session_pool)
         if self.parallel:
-            self.pool = ThreadPool()
+            if workers is None:
+                workers = os.cpu_count() or 1
+            self.pool = ThreadPool(workers)
+            self.session_pool.resize(workers)
 
         self._rough_gen = lru_cache(maxsize=4)(self._rough_gen)
 
@@ -37,72 +59,338 @@ class MapGenerator:
         tile_mn = tuple(map(int, tile_mn))
         tile_mx = tuple(map(int, tile_mx))
         image = self._rough_gen(tile_mn, tile_mx, lod)
-        tile_mx_frac -= 256
-        e0 = tile_mx_frac[0] if tile_mx_frac[0] != 0 else None
-        e1 = tile_mx_frac[1] if tile_mx_frac[1] != 0 else None
-        image_cropped = image[tile_mn_frac[1]:e1, tile_mn_frac[0]:e0]
-        if not as_array:
-            image_cropped = Image.fromarray(image_cropped)
-        return image_cropped
+        if getattr(self.fetcher, 'synthetic', None):
+            # mosaics with tiles synthesized by a FallbackFetcher are not reused, its refine() replaces them
+            self._rough_gen.cache_clear()
+        return _crop(image, tile_mn_frac, tile_mx_frac, as_array)
 
     __call__ = generate_map
 
+    async def agenerate_map(self, geo1, geo2, lod, as_array=False):
+        compound = calculate_coverage(geo1, geo2, lod)
+        tile_mn, tile_mx, tile_mn_frac, tile_mx_frac = compound
+        poses = _tile_grid(tile_mn, tile_mx, lod)
+        from .asyncfetch import AsyncFetcher
+        if isinstance(self.fetcher, AsyncFetcher):
+            image = await self._arough_gen(self.fetcher, poses, tile_mx - tile_mn + 1)
+        else:
+            cache = self.fetcher if isinstance(self.fetcher, CachedFetcher) else None
+            async with AsyncFetcher(self.provider, cache=cache, session_pool=self.session_pool) as fetcher:
+                image = await self._arough_gen(fetcher, poses, tile_mx - tile_mn + 1)
+        return _crop(image, tile_mn_frac, tile_mx_frac, as_array)
+
+    async def _arough_gen(self, fetcher, poses, map_size):
+        async def fetch(i, pos, key):
+            return i, await fetcher(pos, self.provider, as_array=True, key=key)
+
+        mosaic = _Mosaic(map_size)
+        keys = fetcher.keys(poses, self.provider)
+        tiles = asyncio.as_completed([fetch(i, pos, key) for i, (pos, key) in enumerate(zip(poses.tolist(), keys))])
+        if self.progress:
+            from tqdm import tqdm
+            tiles = tqdm(tiles, total=len(poses))
+        for tile in tiles:
+            i, tile = await tile
+            start = time.perf_counter() if metrics.listeners else None
+            mosaic.paste(*(poses[i][:2] - poses[0][:2]), tile)
+            if start is not None:
+                metrics.emit('map.assemble', time.perf_counter() - start)
+        return mosaic.image
+
     def _rough_gen(self, tile_mn, tile_mx, lod):
         tile_mn = np.array(tile_mn, np.int32)
         tile_mx = np.array(tile_mx, np.int32)
-        map_size = tile_mx - tile_mn + 1
         poses = _tile_grid(tile_mn, tile_mx, lod)
-        tiles = self._multifetch(poses)
-        tiles = np.array(tiles)
-        tile_size = tiles.shape[1:]
-        if tiles.ndim == 3:
-            tiles = tiles.reshape(
-                map_size[0], map_size[1], tile_size[1], tile_size[0])
-            tiles = tiles.transpose(1, 2, 0, 3)
-            image = tiles.reshape(
-                map_size[1] * tile_size[1], map_size[0] * tile_size[0])
-        elif tiles.ndim == 4:
-            tiles = tiles.reshape(
-                map_size[0], map_size[1], tile_size[1], tile_size[0], tiles.shape[3])
-            tiles = tiles.transpose(1, 2, 0, 3, 4)
-            image = tiles.reshape(
-                map_size[1] * tile_size[1], map_size[0] * tile_size[0], tiles.shape[4])
+        if self.decode_pool is not None:
+            return self._rough_gen_decoded(poses, tile_mn, tile_mx - tile_mn + 1)
+        mosaic = _Mosaic(tile_mx - tile_mn + 1)
+        for i, tile in self._multifetch(poses):
+            start = time.perf_counter() if metrics.listeners else None
+            mosaic.paste(*(poses[i][:2] - tile_mn), tile)
+            if start is not None:
+                metrics.emit('map.assemble', time.perf_counter() - start)
+        return mosaic.image
+
+    def _rough_gen_decoded(self, poses, tile_mn, map_size):
+        """
+            Assembles the mosaic from raw tiles decoded by the process pool.
+            The mosaic is allocated in shared memory with the channel count of the first tile, and chunks of raw
+            tiles are handed to the workers as they are fetched, which decode them directly into their slices.
+            Tiles with more channels than the mosaic are sent back and pasted after converting it, as _Mosaic does.
+        """
+        tiles = iter(self._multifetch_raw(poses))
+        i, content = next(tiles)
+        first = decode_image(content)
+        tile_size = first.shape[:2]
+        shape = (map_size[1] * tile_size[0], map_size[0] * tile_size[1])
+        if _channels(first) != 1:
+            shape += (_channels(first),)
+        shared = _SharedArray(shape, first.dtype)
+        image = np.asarray(shared)
+        try:
+            deeper = _paste(image, tile_size, *(poses[i][:2] - tile_mn), first)
+            task = (shared.name, shape, first.dtype.str, tile_size)
+            results = []
+            chunk = []
+            for i, content in tiles:
+                chunk.append((*(poses[i][:2] - tile_mn).tolist(), content))
+                if len(chunk) == self.decode_chunk:
+                    results.append(self.decode_pool.apply_async(_decode_into, (task, chunk)))
+                    chunk = []
+            if chunk:
+                results.append(self.decode_pool.apply_async(_decode_into, (task, chunk)))
+            for result in results:
+                deeper.extend(result.get())
+        finally:
+            # the mapping of this process stays, the memory is freed with the last array on it
+            shared.shm.unlink()
+        if deeper:
+            image = _convert_channels(image, max(_channels(tile) for *_, tile in deeper))
+            for col, row, tile in deeper:
+                _paste(image, tile_size, col, row, tile)
         return image
 
-    def _fetch(self, pos):
-        if self.provider is None:
-            return self.fetcher(tuple(pos.tolist()), as_array=True)
+    def _tasks(self, poses):
+        # (index, position, storage key), with the keys of a CachedFetcher built in one batch
+        if isinstance(self.fetcher, CachedFetcher):
+            keys = self.fetcher.keys(poses, self.provider)
         else:
-            return self.fetcher(tuple(pos.tolist()), provider=self.provider, as_array=True)
+            keys = repeat(None)
+        return zip(count(), map(tuple, poses.tolist()), keys)
 
-    def _multifetch(self, poses):
+    def _fetch_raw(self, args):
+        i, pos, key = args
+        return i, self.fetcher(pos, provider=self.provider, as_raw=True, key=key)
+
+    def _multifetch_raw(self, poses):
         if self.parallel:
-            tiles = self.pool.imap(self._fetch, poses)
-            if self.progress:
-                tiles = list(tqdm(tiles, total=len(poses)))
+            tiles = self.pool.imap_unordered(self._fetch_raw, self._tasks(poses))
+        else:
+            tiles = map(self._fetch_raw, self._tasks(poses))
+        if self.progress:
+            from tqdm import tqdm
+            tiles = tqdm(tiles, total=len(poses))
+        return tiles
+
+    def _fetch(self, pos, key=None):
+        if key is not None:
+            return self.fetcher(pos, provider=self.provider, as_array=True, key=key)
+        if self.provider is None:
+            return self.fetcher(pos, as_array=True)
+        else:
+            return self.fetcher(pos, provider=self.provider, as_array=True)
+
+    def _fetch_indexed(self, args):
+        i, pos, key = args
+        return i, self._fetch(pos, key)
+
+    def _fetch_timed(self, args):
+        i, pos, key, submitted = args
+        start = time.perf_counter()
+        metrics.emit('map.queue', start - submitted)
+        tile = self._fetch(pos, key)
+        metrics.emit('map.fetch', time.perf_counter() - start)
+        return i, tile
+
+    def stream_map(self, geo1, geo2, lod, path, channels=3, strip_rows=1):
+        """
+            Generates a map into a .npy file without holding the whole map in memory.
+            Rows of tiles are fetched and assembled in strips of strip_rows, cropped and written to the file.
+            :param path: Path of the .npy file to write.
+            :param channels: Number of channels of the output, 1 (grayscale), 3 (RGB) or 4 (RGBA).
+            :param strip_rows: Number of tile rows assembled in memory at once.
+            :return: The map as a read-write np.memmap of the file.
+        """
+        compound = calculate_coverage(geo1, geo2, lod)
+        tile_mn, tile_mx, tile_mn_frac, tile_mx_frac = compound
+        map_size = tile_mx - tile_mn + 1
+        full_size = 256 * map_size
+        crop_mn = tile_mn_frac
+        crop_mx = full_size + tile_mx_frac - 256
+        shape = (int(crop_mx[1] - crop_mn[1]), int(crop_mx[0] - crop_mn[0]))
+        if channels != 1:
+            shape += (channels,)
+        image = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        progress = None
+        if self.progress:
+            from tqdm import tqdm
+            progress = tqdm(total=int(np.prod(map_size)))
+        for row in range(0, map_size[1], strip_rows):
+            rows = min(strip_rows, map_size[1] - row)
+            strip_mn = (tile_mn[0], tile_mn[1] + row)
+            strip_mx = (tile_mx[0], tile_mn[1] + row + rows - 1)
+            poses = _tile_grid(strip_mn, strip_mx, lod)
+            mosaic = _Mosaic((map_size[0], rows), channels=channels)
+            for i, tile in self._multifetch(poses, progress=False):
+                start = time.perf_counter() if metrics.listeners else None
+                mosaic.paste(*(poses[i][:2] - strip_mn), tile)
+                if start is not None:
+                    metrics.emit('map.assemble', time.perf_counter() - start)
+                if progress is not None:
+                    progress.update()
+            y0 = max(256 * row, crop_mn[1])
+            y1 = min(256 * (row + rows), crop_mx[1])
+            if y1 > y0:
+                image[y0 - crop_mn[1]:y1 - crop_mn[1]] = \
+                    mosaic.image[y0 - 256 * row:y1 - 256 * row, crop_mn[0]:crop_mx[0]]
+            image.flush()
+        if progress is not None:
+            progress.close()
+        return image
+
+    def _multifetch(self, poses, progress=None):
+        if progress is None:
+            progress = self.progress
+        if self.multifetch:
+            tiles = enumerate(self.fetcher(poses, provider=self.provider, as_array=True))
+        elif metrics.listeners:
+            # stamped as the pool takes the tasks, which it does all at once
+            tasks = ((i, pos, key, time.perf_counter()) for i, pos, key in self._tasks(poses))
+            if self.parallel:
+                tiles = self.pool.imap_unordered(self._fetch_timed, tasks)
             else:
-                tiles = list(tiles)
-        elif self.multifetch:
-            tiles = self.fetcher(poses, provider=self.provider, as_array=True)
+                tiles = map(self._fetch_timed, tasks)
+        elif self.parallel:
+            tiles = self.pool.imap_unordered(self._fetch_indexed, self._tasks(poses))
         else:
-            if self.progress:
-                poses = tqdm(poses)
-            tiles = list(map(self._fetch, poses))
+            tiles = map(self._fetch_indexed, self._tasks(poses))
+        if progress:
+            from tqdm import tqdm
+            tiles = tqdm(tiles, total=len(poses))
         return tiles
 
     def close(self):
         if self.parallel and self.pool:
             self.pool.close()
             self.pool.join()
+        if self.decode_pool is not None:
+            self.decode_pool.close()
+            self.decode_pool.join()
+            self.decode_pool = None
 
     def __del__(self):
         self.close()
 
 
-def generate_map(geo1, geo2, lod=18, provider=None, progress=False, parallel=True, as_array=False, fetcher=None):
+def generate_map(geo1, geo2, lod=18, provider=None, progress=False, parallel=True, as_array=False, fetcher=None,
+                 workers=None, session_pool=None, decode_workers=None):
     generator = MapGenerator(
-        provider=provider, fetcher=fetcher, progress=progress, parallel=parallel)
-    return generator.generate_map(geo1, geo2, lod, as_array=as_array)
+        provider=provider, fetcher=fetcher, progress=progress, parallel=parallel,
+        workers=workers, session_pool=session_pool, decode_workers=decode_workers)
+    try:
+        return generator.generate_map(geo1, geo2, lod, as_array=as_array)
+    finally:
+        generator.close()
+
+
+class _Mosaic:
+    """
+        Output image of a tile grid, allocated on the first tile and filled in place as the tiles arrive.
+        Tiles are converted to the given number of channels, or if it is None, to the largest channel count
+        seen so far (grayscale, RGB or RGBA).
+    """
+
+    def __init__(self, map_size, channels=None):
+        self.map_size = map_size
+        self.channels = channels
+        self.image = None
+
+    def paste(self, col, row, tile):
+        tile = np.asarray(tile)
+        if self.image is None:
+            self.tile_size = tile.shape[:2]
+            shape = (self.map_size[1] * self.tile_size[0], self.map_size[0] * self.tile_size[1])
+            channels = _channels(tile) if self.channels is None else self.channels
+            if channels != 1:
+                shape += (channels,)
+            self.image = np.zeros(shape, dtype=tile.dtype)
+        channels = _channels(self.image)
+        if self.channels is None and _channels(tile) > channels:
+            channels = _channels(tile)
+            self.image = _convert_channels(self.image, channels)
+        h, w = self.tile_size
+        self.image[row * h:(row + 1) * h, col * w:(col + 1) * w] = _convert_channels(tile, channels)
+
+
+class _SharedArray:
+    """
+        Array in shared memory that process pool workers attach to by name. The array np.asarray gives keeps
+        the memory mapped for as long as it or any view of it is alive.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+        self.name = self.shm.name
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.__array_interface__ = self.array.__array_interface__
+
+    def __del__(self):
+        # the buffer can only be closed once no array exports it
+        self.array = None
+        self.shm.close()
+
+
+def _paste(image, tile_size, col, row, tile):
+    """
+        Pastes a tile into its slice of the mosaic, converted to the channel count of the mosaic.
+        :return: [(col, row, tile)] if the tile has more channels than the mosaic and was not pasted, else [].
+    """
+    if _channels(tile) > _channels(image):
+        return [(col, row, tile)]
+    h, w = tile_size
+    image[row * h:(row + 1) * h, col * w:(col + 1) * w] = _convert_channels(tile, _channels(image))
+    return []
+
+
+def _decode_into(task, tiles):
+    """
+        Process pool worker, decodes raw tiles into their slices of a shared memory mosaic.
+        :return: The (col, row, tile) of the tiles with more channels than the mosaic, which are left to the caller.
+    """
+    name, shape, dtype, tile_size = task
+    shm = shared_memory.SharedMemory(name=name)
+    image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        deeper = []
+        for col, row, content in tiles:
+            deeper.extend(_paste(image, tile_size, col, row, decode_image(content)))
+    finally:
+        image = None
+        shm.close()
+    return deeper
+
+
+def _channels(image):
+    return 1 if image.ndim == 2 else image.shape[2]
+
+
+def _convert_channels(image, channels):
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+    current = _channels(image)
+    if current == channels:
+        return image
+    if channels == 1:
+        gray = image[:, :, :3] @ np.array([299, 587, 114], dtype=np.uint32) // 1000
+        return gray.astype(image.dtype)
+    converted = np.empty(image.shape[:2] + (channels,), dtype=image.dtype)
+    if current == 1:
+        converted[:, :, :3] = image[:, :, None]
+    else:
+        converted[:, :, :min(3, current)] = image[:, :, :3]
+    if channels == 4:
+        converted[:, :, 3] = image[:, :, 3] if current == 4 else np.iinfo(image.dtype).max
+    return converted
+
+
+def _crop(image, tile_mn_frac, tile_mx_frac, as_array=False):
+    tile_mx_frac = tile_mx_frac - 256
+    e0 = tile_mx_frac[0] if tile_mx_frac[0] != 0 else None
+    e1 = tile_mx_frac[1] if tile_mx_frac[1] != 0 else None
+    image_cropped = image[tile_mn_frac[1]:e1, tile_mn_frac[0]:e0]
+    if not as_array:
+        image_cropped = Image.fromarray(image_cropped)
+    return image_cropped
 
 
 def _tile_grid(tile_mn, tile_mx, lod):
@@ -114,6 +402,17 @@ def _tile_grid(tile_mn, tile_mx, lod):
     return poses
 
 
+def stream_map(geo1, geo2, path, lod=18, provider=None, progress=False, parallel=True, fetcher=None,
+               workers=None, session_pool=None, channels=3, strip_rows=1):
+    generator = MapGenerator(
+        provider=provider, fetcher=fetcher, progress=progress, parallel=parallel,
+        workers=workers, session_pool=session_pool)
+    try:
+        return generator.stream_map(geo1, geo2, lod, path, channels=channels, strip_rows=strip_rows)
+    finally:
+        generator.close()
+
+
 def calculate_coverage(geo1, geo2, lod=18):
     tile1 = np.array(geodetic2tile(*geo1, lod)[:2], np.float64)
     tile2 = np.array(geodetic2tile(*geo2, lod)[:2], np.float64)
@@ -129,31 +428,85 @@ def calculate_coverage(geo1, geo2, lod=18):
 
 
 def split_map(image, geo1, geo2, lod=18, as_array=False):
+    return list(iter_split_map(image, geo1, geo2, lod, as_array))
+
+
+def iter_split_map(image, geo1, geo2, lod=18, as_array=False):
+    """
+        Splits a map image of the area between geo1 and geo2 into its tiles, yielding (pos, tile) pairs.
+        Tiles lying inside the image are views of it, only those on its border are copied to pad them with zeros.
+        Images of another size than generate_map would make for the area are resized first.
+    """
     if isinstance(image, Image.Image):
-        image = np.array(image).astype(np.uint8)
-    compound = calculate_coverage(geo1, geo2, lod)
-    tile_mn, tile_mx, tile_mn_frac, tile_mx_frac = compound
-    poses = _tile_grid(tile_mn, tile_mx, lod)
-    tile_size = tile_mx - tile_mn
-    image_full_size = 256 * (tile_size + 1)
-    if len(image.shape) == 3:
-        image_full_size = np.concatenate([image_full_size[::-1], [3]])
-    else:
-        image_full_size = image_full_size[::-1]
-    image_size = 256 * tile_size + tile_mx_frac - tile_mn_frac
+        image = np.asarray(image)
+    tile_mn, tile_mx, tile_mn_frac, tile_mx_frac = calculate_coverage(geo1, geo2, lod)
+    image_size = 256 * (tile_mx - tile_mn) + tile_mx_frac - tile_mn_frac
     if not np.equal(image_size[::-1], image.shape[:2]).all():
-        image = cv2.resize(image, tuple(image_size),
-                           interpolation=cv2.INTER_NEAREST)
-    padded = np.zeros(image_full_size, dtype=image.dtype)
-    tile_mx_frac -= 256
-    e0 = tile_mx_frac[0] if tile_mx_frac[0] != 0 else None
-    e1 = tile_mx_frac[1] if tile_mx_frac[1] != 0 else None
-    padded[tile_mn_frac[1]:e1, tile_mn_frac[0]:e0] = image
-    images = []
-    for pos in poses:
-        x, y, _ = pos - poses[0]
-        image = padded[y * 256:(y + 1) * 256, x * 256:(x + 1) * 256]
+        image = _resize(image, tuple(map(int, image_size)))
+    for pos in _tile_grid(tile_mn, tile_mx, lod):
+        # top left corner of the tile in the image, negative for the first row and column
+        x0, y0 = (256 * (pos[:2] - tile_mn) - tile_mn_frac).tolist()
+        tile = image[max(y0, 0):y0 + 256, max(x0, 0):x0 + 256]
+        if tile.shape[:2] != (256, 256):
+            padded = np.zeros((256, 256) + image.shape[2:], dtype=image.dtype)
+            padded[max(-y0, 0):max(-y0, 0) + tile.shape[0], max(-x0, 0):max(-x0, 0) + tile.shape[1]] = tile
+            tile = padded
         if not as_array:
-            image = Image.fromarray(image)
-        images.append((pos, image))
-    return images
+            tile = Image.fromarray(tile)
+        yield pos, tile
+
+
+def store_map(image, geo1, geo2, fetcher, provider, lod=18, format='png', workers=None, progress=False):
+    """
+        Splits a map image into tiles and writes them into a tile cache, e.g. to publish a processed mosaic
+        under a provider name of its own. Tiles are encoded and written in parallel as they are split off.
+        :param fetcher: CachedFetcher or TileStorage to write the tiles to.
+        :param provider: Provider name or function to store the tiles under. Names need a storage keyed on
+            provider names, i.e. the sharded or SQLite layout.
+        :param format: Image format of the tiles, 'png', 'jpeg' or 'webp'.
+        :param workers: Number of threads to use.
+        :param progress: Whether to show a progress bar.
+        :return: The number of tiles written.
+    """
+    storage = fetcher if isinstance(fetcher, TileStorage) else fetcher.storage
+    if isinstance(provider, str) and isinstance(storage, DirectoryStorage) \
+            and not isinstance(storage, ShardedStorage):
+        raise ValueError('The flat layout keys tiles by URL, use the sharded or SQLite layout to store them by name')
+    content_type = f'image/{format}'
+
+    def store(args):
+        pos, tile = args
+        pos = tuple(pos.tolist())
+        content = _encode(tile, format)
+        if storage is fetcher:
+            storage.put(storage.key(provider, pos), content, content_type)
+        else:
+            fetcher.store_raw(pos, content, content_type, provider)
+
+    tiles = iter_split_map(image, geo1, geo2, lod, as_array=True)
+    with ThreadPool(workers or os.cpu_count() or 1) as pool:
+        results = pool.imap_unordered(store, tiles, chunksize=16)
+        if progress:
+            from tqdm import tqdm
+            tile_mn, tile_mx, _, _ = calculate_coverage(geo1, geo2, lod)
+            results = tqdm(results, total=int(np.prod(tile_mx - tile_mn + 1)))
+        written = sum(1 for _ in results)
+    storage.flush()
+    return written
+
+
+def _resize(image, size):
+    # nearest neighbour, with OpenCV if it is installed and Pillow otherwise
+    cv2 = load_cv2()
+    if cv2 is not None:
+        return cv2.resize(image, size, interpolation=cv2.INTER_NEAREST)
+    return np.asarray(Image.fromarray(image).resize(size, Image.NEAREST))
+
+
+def _encode(image, format):
+    image = Image.fromarray(image)
+    if format == 'jpeg' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+    f = io.BytesIO()
+    image.save(f, format=format)
+    return f.getvalue()
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """
+        Thread-safe LRU cache of decoded tiles, bounded by the total size of the stored arrays.
+        Tiles are kept once, as read-only numpy arrays, whatever representation the caller asked for.
+        Callers put and get writable copies of them, so that changing a returned tile does not change the cache.
+        With readonly, the cached arrays themselves are handed out and no copies are made.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, readonly=False):
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+        return value if self.readonly else value.copy()
+
+    def put(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        if not self.readonly:
+            value = value.copy()
+        value.setflags(write=False)
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self.items.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+    def discard_if(self, predicate):
+        """
+            Removes the tiles whose key satisfies predicate, e.g. those of a storage being closed.
+        """
+        with self.lock:
+            for key in [key for key in self.items if predicate(key)]:
+                self.nbytes -= self.items.pop(key).nbytes
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tiles': len(self.items),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+
+default_memory_cache = MemoryCache()
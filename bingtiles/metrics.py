@@ -0,0 +1,148 @@
+import math
+import threading
+from contextlib import contextmanager
+
+# replaced rather than modified, so that emitting threads can iterate over it without a lock
+listeners = []
+
+
+def add_listener(listener):
+    global listeners
+    if listener not in listeners:
+        listeners = listeners + [listener]
+
+
+def remove_listener(listener):
+    global listeners
+    listeners = [other for other in listeners if other is not listener]
+
+
+def emit(stage, seconds=0.0, **info):
+    """
+        Sends an event to the listeners, callables taking (stage, seconds, info) where info is a dict of
+        stage specific fields such as bytes or hit. The stages are:
+            fetch.network   one HTTP request (status, bytes)
+            cache.memory    a lookup in the memory cache (hit)
+            cache.read      a lookup in the tile storage (hit, bytes)
+            cache.decode    decoding a tile image
+            cache.store     writing a tile to the storage (bytes)
+            map.queue       time a tile waited in the MapGenerator pool before being fetched
+            map.fetch       fetching a tile in MapGenerator, including the stages above
+            map.assemble    pasting a tile into the mosaic
+        Instrumented code only calls it if listeners is not empty, so there is no cost while nothing listens.
+    """
+    for listener in listeners:
+        listener(stage, seconds, info)
+
+
+@contextmanager
+def collect(aggregator=None):
+    """
+        Aggregates the events emitted within the block.
+        :return: The MetricsAggregator.
+    """
+    if aggregator is None:
+        aggregator = MetricsAggregator()
+    add_listener(aggregator)
+    try:
+        yield aggregator
+    finally:
+        remove_listener(aggregator)
+
+
+class _Stage:
+    def __init__(self, buckets):
+        self.count = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.histogram = [0] * buckets
+
+
+class MetricsAggregator:
+    """
+        Listener keeping per-stage counts, totals and histograms of durations.
+        Histogram buckets are powers of two of microseconds, so percentiles are upper bounds within a factor of two.
+    """
+
+    buckets = 32
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, stage, seconds, info):
+        bucket = min(self.buckets - 1, max(0, math.ceil(math.log2(max(seconds * 1e6, 1)))))
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = _Stage(self.buckets)
+            entry.count += 1
+            entry.seconds += seconds
+            entry.max = max(entry.max, seconds)
+            entry.histogram[bucket] += 1
+            entry.bytes += info.get('bytes', 0)
+            hit = info.get('hit')
+            if hit is not None:
+                if hit:
+                    entry.hits += 1
+                else:
+                    entry.misses += 1
+            status = info.get('status', 200)
+            if status is None or status >= 400:
+                entry.errors += 1
+
+    def percentile(self, stage, q):
+        """
+            :return: Upper bound of the q-th percentile (0 to 100) of the durations of a stage in seconds.
+        """
+        with self.lock:
+            entry = self.stages[stage]
+            rank = q / 100 * entry.count
+            seen = 0
+            for bucket, count in enumerate(entry.histogram):
+                seen += count
+                if count and seen >= rank:
+                    return min(2 ** bucket / 1e6, entry.max)
+            return entry.max
+
+    def stats(self):
+        stats = {}
+        for stage in list(self.stages):
+            entry = self.stages[stage]
+            stats[stage] = {
+                'count': entry.count,
+                'seconds': entry.seconds,
+                'mean': entry.seconds / entry.count,
+                'p50': self.percentile(stage, 50),
+                'p90': self.percentile(stage, 90),
+                'p99': self.percentile(stage, 99),
+                'max': entry.max,
+                'bytes': entry.bytes,
+                'hits': entry.hits,
+                'misses': entry.misses,
+                'errors': entry.errors,
+                'histogram': list(entry.histogram),
+            }
+        return stats
+
+    def summary(self):
+        lines = [f'{"stage":<14}{"count":>8}{"total s":>10}{"mean ms":>10}{"p50 ms":>9}{"p90 ms":>9}'
+                 f'{"p99 ms":>9}{"max ms":>9}{"MB":>9}  other']
+        for stage, entry in sorted(self.stats().items()):
+            other = []
+            if entry['hits'] or entry['misses']:
+                other.append(f'hit rate {entry["hits"] / (entry["hits"] + entry["misses"]):.1%}')
+            if entry['errors']:
+                other.append(f'{entry["errors"]} errors')
+            lines.append(f'{stage:<14}{entry["count"]:>8}{entry["seconds"]:>10.2f}{entry["mean"] * 1e3:>10.2f}'
+                         f'{entry["p50"] * 1e3:>9.2f}{entry["p90"] * 1e3:>9.2f}{entry["p99"] * 1e3:>9.2f}'
+                         f'{entry["max"] * 1e3:>9.2f}{entry["bytes"] / 1e6:>9.2f}  {", ".join(other)}')
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+DAY = 24 * 60 * 60
+
+# seconds to remember a tile as unavailable, by HTTP status or 'placeholder'; other statuses use default_ttl
+DEFAULT_TTLS = {
+    204: 7 * DAY,
+    404: 7 * DAY,
+    410: 30 * DAY,
+    'placeholder': 30 * DAY,
+}
+
+# header Bing sends with its "no imagery" placeholder tiles, for placeholder_headers
+BING_NO_TILE = {'X-VE-Tile-Info': 'no-tile'}
+
+
+class NegativeCache:
+    """
+        Remembers tiles that failed to download, so that they are not requested again until their TTL expires.
+        Besides non-200 responses, empty responses are recorded as 204 and "no imagery" placeholder tiles as
+        'placeholder'. Placeholders are only detected on request: by the sha256 hex digests given in placeholders,
+        or by the header values given in placeholder_headers, e.g. BING_NO_TILE. Otherwise they are proper tiles.
+        If path is given, entries are appended to it as JSON lines and loaded back when the cache is created.
+    """
+
+    def __init__(self, path=None, ttls=None, default_ttl=60, placeholders=(), placeholder_headers=None):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.placeholders = set(placeholders)
+        self.placeholder_headers = dict(placeholder_headers or {})
+        self.entries = {}
+        self.hits = 0
+        self.file = None
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def get(self, key):
+        """
+            :return: The status the tile was recorded with, or None if it is not recorded or has expired.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        status, expires = entry
+        if expires < time.time():
+            with self.lock:
+                if self.entries.get(key) == entry:
+                    del self.entries[key]
+            return None
+        self.hits += 1
+        return status
+
+    def put(self, key, status, ttl=None):
+        if ttl is None:
+            ttl = self.ttls.get(status, self.default_ttl)
+        if ttl <= 0:
+            return
+        expires = time.time() + ttl
+        with self.lock:
+            self.entries[key] = status, expires
+            if self.path is not None:
+                if self.file is None:
+                    self.file = open(self.path, 'a')
+                self.file.write(json.dumps([key, status, expires]) + '\n')
+
+    def classify(self, status, content, headers=None):
+        """
+            :return: The status to record a response with, or None if it is a proper tile.
+        """
+        if status != 200:
+            return status
+        if not content:
+            return 204
+        if headers is not None and any(headers.get(name) == value for name, value in self.placeholder_headers.items()):
+            return 'placeholder'
+        if self.placeholders and hashlib.sha256(content).hexdigest() in self.placeholders:
+            return 'placeholder'
+        return None
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.path is not None:
+                self._rewrite()
+
+    def load(self):
+        now = time.time()
+        count = 0
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    key, status, expires = json.loads(line)
+                except ValueError:
+                    continue
+                count += 1
+                if isinstance(key, list):
+                    key = tuple(key)
+                if expires >= now:
+                    self.entries[key] = status, expires
+                else:
+                    self.entries.pop(key, None)
+        if count > 2 * len(self.entries):
+            with self.lock:
+                self._rewrite()
+
+    def _rewrite(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for key, (status, expires) in self.entries.items():
+                f.write(json.dumps([key, status, expires]) + '\n')
+        os.replace(tmp, self.path)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def stats(self):
+        return {'tiles': len(self.entries), 'hits': self.hits}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+default_negative_cache = NegativeCache()
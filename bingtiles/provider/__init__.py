@@ -1,15 +1,129 @@
-from .bing import *
-from .esri import *
-from .google import *
-
-from .bing import providers as bing_providers
-from .esri import providers as esri_providers
-from .google import providers as google_providers
-
-providers = {
-    **bing_providers,
-    **esri_providers,
-    **google_providers,
+import sys
+from importlib import import_module
+from collections.abc import Mapping
+
+# provider modules are imported on first use, so that picking one provider does not load the others
+_modules = {
+    'bing': ['BING_DEFAULT_VERSION', 'provider_bing_base', 'provider_bing_aerial', 'provider_bing_road',
+             'provider_bing_terrain', 'provider_bing_hybrid', 'urls_bing_base', 'urls_bing_aerial', 'urls_bing_road',
+             'urls_bing_terrain', 'urls_bing_hybrid', 'parse_bing_url'],
+    'esri': ['provider_esri_base', 'provider_esri_aerial', 'provider_esri_road', 'provider_esri_terrain',
+             'provider_esri_topo', 'urls_esri_base', 'urls_esri_aerial', 'urls_esri_road', 'urls_esri_terrain',
+             'urls_esri_topo', 'parse_esri_url'],
+    'google': ['GoogleMapType', 'GoogleVersions', 'default_google_versions', 'get_api_js', 'section_get',
+               'provider_google_map', 'provider_google_satellite', 'provider_google_satellite2',
+               'provider_google_labels', 'provider_google_terrain', 'provider_google_hybrid', 'parse_google_url'],
+}
+
+_registry = {
+    'bing_aerial': 'bing',
+    'bing_road': 'bing',
+    'bing_terrain': 'bing',
+    'bing_hybrid': 'bing',
+    'esri_aerial': 'esri',
+    'esri_road': 'esri',
+    'esri_terrain': 'esri',
+    'esri_topo': 'esri',
+    'google_map': 'google',
+    'google_satellite': 'google',
+    'google_satellite2': 'google',
+    'google_labels': 'google',
+    'google_terrain': 'google',
+    'google_hybrid': 'google',
 }
 
+_exports = {name: module for module, names in _modules.items() for name in names}
+_exports.update({f'{module}_providers': module for module in _modules})
+
+__all__ = ['providers', 'default_provider', 'provider_name', 'provider_urls', 'parse_url', *_exports]
+
+
+def _module(module):
+    return import_module(f'{__name__}.{module}')
+
+
+def _loaded_modules():
+    return [sys.modules[f'{__name__}.{module}'] for module in _modules if f'{__name__}.{module}' in sys.modules]
+
+
+class _Providers(Mapping):
+    """
+        Read-only mapping of provider names to URL builders, importing the module of a provider when it is looked up.
+    """
+
+    def __getitem__(self, name):
+        if name not in _registry:
+            raise KeyError(name)
+        return _module(_registry[name]).providers[name]
+
+    def __iter__(self):
+        return iter(_registry)
+
+    def __len__(self):
+        return len(_registry)
+
+    def __contains__(self, name):
+        return name in _registry
+
+    def __repr__(self):
+        return f'providers({list(_registry)})'
+
+
+providers = _Providers()
+
 default_provider = 'bing_hybrid'
+
+
+def __getattr__(name):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if name == f'{module}_providers':
+        return _module(module).providers
+    return getattr(_module(module), name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+def provider_name(provider):
+    """
+        Returns the name tiles of a provider are stored under: a string as is, the registered name of a provider
+        function, or else its __name__. Lambdas, functools.partial and other callables without a name of their own
+        raise a ValueError, as they would share one key with each other or get a new one on every run.
+    """
+    if isinstance(provider, str):
+        return provider
+    # a provider function can only come from a module that is already imported
+    for module in _loaded_modules():
+        for name, value in module.providers.items():
+            if value == provider:
+                return name
+    name = getattr(provider, '__name__', None)
+    if not name or name == '<lambda>':
+        raise ValueError(f'Provider {provider!r} has no name to store its tiles under, set its __name__')
+    return name
+
+
+def provider_urls(provider, poses):
+    """
+        Builds the URLs of many tiles at once, with the batch version of the provider if it is a registered one.
+        :param poses: Array-like of shape (N, 3) of tile X, Y and level of detail, e.g. from _tile_grid.
+        :return: A list of N URLs.
+    """
+    for module in _loaded_modules():
+        for name, value in module.providers.items():
+            if value == provider:
+                return module.batch_providers[name](poses)
+    if hasattr(poses, 'tolist'):
+        poses = poses.tolist()
+    return [provider(tuple(pos)) for pos in poses]
+
+
+def parse_url(url):
+    for module in _modules:
+        result = getattr(_module(module), f'parse_{module}_url')(url)
+        if result is not None:
+            return result
+    return None
@@ -1,4 +1,8 @@
-from ..utils import tile2quad, get_server_num
+import re
+
+import numpy as np
+
+from ..utils import tile2quad, tile2quad_np, quad2tile, get_server_num
 
 
 BING_DEFAULT_VERSION = '5001'
@@ -37,9 +41,57 @@ def provider_bing_hybrid(pos, **kwargs):
     return provider_bing_base(pos, type='h', **kwargs)
 
 
+def urls_bing_base(poses, type, **kwargs):
+    """
+        Batch version of provider_bing_base.
+        :param poses: Array-like of shape (N, 3) of tile X, Y and level of detail.
+        :return: A list of N URLs.
+    """
+    x, y, z = np.asarray(poses, dtype=np.int64).reshape(-1, 3).T
+    if 'g' not in kwargs:
+        kwargs['g'] = BING_DEFAULT_VERSION
+    prefixes = [f'http://ecn.t{n}.tiles.virtualearth.net/tiles/{type}' for n in range(4)]
+    suffix = '.jpeg?' + '&'.join(f'{k}={v}' for k, v in kwargs.items())
+    servers = get_server_num(x, y, 4).tolist()
+    return [prefixes[n] + quadkey + suffix for n, quadkey in zip(servers, tile2quad_np(x, y, z).tolist())]
+
+
+def urls_bing_aerial(poses, **kwargs):
+    return urls_bing_base(poses, type='a', **kwargs)
+
+
+def urls_bing_road(poses, **kwargs):
+    return urls_bing_base(poses, type='r', **kwargs)
+
+
+def urls_bing_terrain(poses, **kwargs):
+    return urls_bing_base(poses, type='t', **kwargs)
+
+
+def urls_bing_hybrid(poses, **kwargs):
+    return urls_bing_base(poses, type='h', **kwargs)
+
+
 providers = {
     'bing_aerial': provider_bing_aerial,
     'bing_road': provider_bing_road,
     'bing_terrain': provider_bing_terrain,
     'bing_hybrid': provider_bing_hybrid,
 }
+
+batch_providers = {
+    'bing_aerial': urls_bing_aerial,
+    'bing_road': urls_bing_road,
+    'bing_terrain': urls_bing_terrain,
+    'bing_hybrid': urls_bing_hybrid,
+}
+
+_re_url = re.compile(r'tiles\.virtualearth\.net/tiles/([a-z])([0-3]*)\.jpeg')
+_types = {'a': 'bing_aerial', 'r': 'bing_road', 't': 'bing_terrain', 'h': 'bing_hybrid'}
+
+
+def parse_bing_url(url):
+    match = _re_url.search(url)
+    if not match or match.group(1) not in _types:
+        return None
+    return _types[match.group(1)], quad2tile(match.group(2))
@@ -1,4 +1,6 @@
-from ..utils import quad2tile
+import re
+
+import numpy as np
 
 
 def provider_esri_base(pos, type='World_Imagery'):
@@ -23,9 +25,58 @@ def provider_esri_topo(pos):
     return provider_esri_base(pos, type='World_Topo_Map')
 
 
+def urls_esri_base(poses, type='World_Imagery'):
+    """
+        Batch version of provider_esri_base.
+        :param poses: Array-like of shape (N, 3) of tile X, Y and level of detail.
+        :return: A list of N URLs.
+    """
+    prefix = f'https://server.arcgisonline.com/ArcGIS/rest/services/{type}/MapServer/tile/'
+    return [f'{prefix}{z}/{y}/{x}' for x, y, z in np.asarray(poses, dtype=np.int64).reshape(-1, 3).tolist()]
+
+
+def urls_esri_aerial(poses):
+    return urls_esri_base(poses, type='World_Imagery')
+
+
+def urls_esri_road(poses):
+    return urls_esri_base(poses, type='World_Street_Map')
+
+
+def urls_esri_terrain(poses):
+    return urls_esri_base(poses, type='World_Terrain_Base')
+
+
+def urls_esri_topo(poses):
+    return urls_esri_base(poses, type='World_Topo_Map')
+
+
 providers = {
     'esri_aerial': provider_esri_aerial,
     'esri_road': provider_esri_road,
     'esri_terrain': provider_esri_terrain,
     'esri_topo': provider_esri_topo,
 }
+
+batch_providers = {
+    'esri_aerial': urls_esri_aerial,
+    'esri_road': urls_esri_road,
+    'esri_terrain': urls_esri_terrain,
+    'esri_topo': urls_esri_topo,
+}
+
+_re_url = re.compile(r'arcgisonline\.com/ArcGIS/rest/services/(\w+)/MapServer/tile/(\d+)/(\d+)/(\d+)')
+_types = {
+    'World_Imagery': 'esri_aerial',
+    'World_Street_Map': 'esri_road',
+    'World_Terrain_Base': 'esri_terrain',
+    'World_Topo_Map': 'esri_topo',
+}
+
+
+def parse_esri_url(url):
+    match = _re_url.search(url)
+    if not match or match.group(1) not in _types:
+        return None
+    z, y, x = map(int, match.group(2, 3, 4))
+    return _types[match.group(1)], (x, y, z)
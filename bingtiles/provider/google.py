@@ -1,20 +1,34 @@
-import requests
+import os
 import re
+import json
+import time
+import threading
 from dataclasses import dataclass
+
+import numpy as np
+
+from ..utils import get_server_num
+
 try:
-    from functools import cache
+    import fcntl
 except ImportError:
-    from functools import lru_cache as cache
+    fcntl = None
+    import msvcrt
 
-from ..utils import get_server_num
+DAY = 24 * 60 * 60
+API_JS_URL = 'http://maps.google.com/maps/api/js?v=3.2&sensor=false'
 
 re_map = re.compile(r'"*https?:\/\/mt\D?\d..*\/vt\?lyrs=(m@\d*)')
 re_satellite = re.compile(r'"*https?:\/\/khm\D?\d.googleapis.com\/kh\?v=(\d*)')
 re_terrain = re.compile(r'"*https?:\/\/mt\D?\d..*\/vt\?lyrs=(t@\d*,r@\d*)')
 
+re_url = re.compile(r'//([a-z]+)\d\.google\.com/(\w+)/(lyrs|v)=([^&]*)&hl=\w*&x=(\d+)(?:&s=)?&y=(\d+)&z=(\d+)')
+
 template1 = 'http://{}{}.google.com/{}/lyrs={}&hl={}&x={}{}&y={}&z={}&s={}'
 template2 = 'http://{}{}.google.com/{}/v={}&hl={}&x={}{}&y={}&z={}&s={}'
 
+sections = ['Galileo'[:i] for i in range(8)]
+
 
 @dataclass(unsafe_hash=True)
 class GoogleMapType:
@@ -26,16 +40,23 @@ class GoogleMapType:
     default_version: str
     version: str = None
 
-    @cache
+    def get_version(self):
+        """
+            :return: version if it is set, else the version in default_google_versions, else default_version.
+        """
+        return self.version or default_google_versions.get(self.name) or self.default_version
+
     def try_get_version(self):
-        if self.regex:
-            js = get_api_js()
-            match = re.search(self.regex, js)
-            if not match:
-                self.version = self.default_version
-                return
-            match = match.group(1)
-            self.version = match
+        """
+            Discovers the versions now instead of in the background.
+            :return: The version URLs are built with.
+        """
+        if self.regex is not None:
+            try:
+                default_google_versions.refresh()
+            except (OSError, ValueError):
+                pass
+        return self.get_version()
 
     def tile_url_get(self, pos):
         x, y, z = pos
@@ -45,7 +66,7 @@ class GoogleMapType:
             self.server,
             num,
             self.request,
-            self.version,
+            self.get_version(),
             'en',
             x,
             sec1,
@@ -55,29 +76,187 @@ class GoogleMapType:
         )
         return url
 
+    def tile_urls_get(self, poses):
+        """
+            Batch version of tile_url_get.
+            :param poses: Array-like of shape (N, 3) of tile X, Y and level of detail.
+            :return: A list of N URLs.
+        """
+        poses = np.asarray(poses, dtype=np.int64).reshape(-1, 3)
+        x, y = poses[:, 0], poses[:, 1]
+        # the template is split around its fields once, the parts up to x only vary by server number
+        p = self.template.split('{}')
+        version = self.get_version()
+        heads = [f'{p[0]}{self.server}{p[1]}{num}{p[2]}{self.request}{p[3]}{version}{p[4]}en{p[5]}' for num in range(4)]
+        sec1s = np.where((y >= 10000) & (y < 100000), '&s=', '').tolist()
+        sec2s = np.take(sections, (x * 3 + y) % 8).tolist()
+        servers = get_server_num(x, y, 4).tolist()
+        return [f'{heads[num]}{x}{p[6]}{sec1}{p[7]}{y}{p[8]}{z}{p[9]}{sec2}{p[10]}'
+                for num, sec1, sec2, (x, y, z) in zip(servers, sec1s, sec2s, poses.tolist())]
+
 
 types = {
-    'map': ('m', 'mt', re_map, template1, 'm@354000000', 'm@354000000'),
-    'satellite': ('khm', 'kh', re_satellite, template2, '944', '944'),
-    'satellite2': ('mt', 'vt', None, template1, 's', 's'),
-    'labels': ('mts', 'vt', None, template1, 'h@336', 'h@336'),
+    'map': ('m', 'mt', re_map, template1, 'm@354000000'),
+    'satellite': ('khm', 'kh', re_satellite, template2, '944'),
+    'satellite2': ('mt', 'vt', None, template1, 's'),
+    'labels': ('mts', 'vt', None, template1, 'h@336'),
     'terrain': ('mt', 'vt', re_terrain, template2, 't@354,r@354000000'),
-    'hybrid': ('mt', 'vt', None, template1, 'y', 'y'),
+    'hybrid': ('mt', 'vt', None, template1, 'y'),
 }
 
 for name, value in types.items():
     types[name] = GoogleMapType(name, *value)
 
 
-@cache
-def get_api_js():
-    url = 'http://maps.google.com/maps/api/js?v=3.2&sensor=false'
-    return requests.get(url).text
+def get_api_js(timeout=10):
+    import requests
+    r = requests.get(API_JS_URL, timeout=timeout)
+    r.raise_for_status()
+    return r.text
+
+
+def default_versions_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'bingtiles', 'google_versions.json')
+
+
+class GoogleVersions:
+    """
+        Tile versions discovered from the Maps API script, kept in a JSON file shared by all processes.
+        get never waits for the network: it returns the known version, or None until one is discovered.
+        Once the versions are older than ttl, a background thread downloads the script again and replaces
+        the file, which the other processes reload when they next check it, at most every check_interval seconds.
+        One process refreshes at a time, holding an OS lock on a .lock file next to the JSON file, which is
+        released when the process exits, and a failed refresh is retried after retry_interval. With path None the versions are kept in memory only, and with
+        background False they are only discovered by calling refresh.
+    """
+
+    def __init__(self, path=None, ttl=DAY, retry_interval=15 * 60, check_interval=60, background=True):
+        self.path = path
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self.background = background
+        # replaced rather than modified, so that get can read it without the lock
+        self.versions = {}
+        self.fetched = 0.0
+        self.retry_at = 0.0
+        self.mtime = None
+        self.next_check = 0.0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.check_interval
+            self.check()
+        return self.versions.get(name)
+
+    def check(self):
+        """
+            Reloads the file if another process has replaced it, and starts a background refresh if it is stale.
+        """
+        with self.lock:
+            if self.path is not None:
+                self.load()
+            now = time.time()
+            if not self.background or now < self.fetched + self.ttl or now < self.retry_at:
+                return
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._refresh, daemon=True)
+            self.thread.start()
+
+    def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.mtime = mtime
+        if data.get('fetched', 0) > self.fetched:
+            self.versions = dict(data.get('versions', {}))
+            self.fetched = data['fetched']
+
+    def refresh(self):
+        """
+            Downloads the Maps API script and stores the versions found in it.
+            :return: The dict of versions by map type name.
+        """
+        js = get_api_js()
+        versions = {}
+        for name, type in types.items():
+            if type.regex is not None:
+                match = type.regex.search(js)
+                if match:
+                    versions[name] = match.group(1)
+        if not versions:
+            raise ValueError('No tile versions found in the Maps API script')
+        fetched = time.time()
+        with self.lock:
+            self.versions = versions
+            self.fetched = fetched
+            if self.path is not None:
+                self.save()
+        return versions
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'fetched': self.fetched, 'versions': self.versions}, f)
+        os.replace(tmp, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+    def _refresh(self):
+        lock = None
+        if self.path is not None:
+            lock = _claim(self.path + '.lock')
+            if lock is None:
+                # another process is refreshing, its versions are picked up by the next check
+                self.retry_at = time.time() + self.check_interval
+                return
+        try:
+            self.refresh()
+        except (OSError, ValueError):
+            self.retry_at = time.time() + self.retry_interval
+        finally:
+            if lock is not None:
+                lock.close()
+
+
+def _claim(path):
+    """
+        Takes an exclusive lock on a file without waiting. The OS releases it when the file is closed
+        or the process exits, also when it is killed during a refresh.
+        :return: The open lock file, to close once done, or None if another process holds the lock.
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        f = open(path, 'a+b')
+    except OSError:
+        return None
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+default_google_versions = GoogleVersions(default_versions_path())
 
 
 def section_get(x, y):
-    sec_length = (x * 3 + y) % 8
-    sec2 = 'Galileo'[:sec_length]
+    sec2 = sections[(x * 3 + y) % 8]
     if y >= 10000 and y < 100000:
         sec1 = '&s='
     else:
@@ -100,3 +279,20 @@ providers = {
     'google_terrain': provider_google_terrain,
     'google_hybrid': provider_google_hybrid,
 }
+
+batch_providers = {name: types[name.split('_', 1)[1]].tile_urls_get for name in providers}
+
+
+def parse_google_url(url):
+    match = re_url.search(url)
+    if not match:
+        return None
+    server, request, key, version, x, y, z = match.groups()
+    candidates = [t for t in types.values()
+                  if t.server == server and t.request == request and f'/{key}=' in t.template]
+    if len(candidates) > 1:
+        candidates = [t for t in candidates if t.get_version()[:1] == version[:1]]
+    pos = int(x), int(y), int(z)
+    if len(candidates) != 1:
+        return None, pos
+    return f'google_{candidates[0].name}', pos
@@ -0,0 +1,242 @@
+import threading
+
+import numpy as np
+from PIL import Image
+from multiprocessing.dummy import Pool as ThreadPool
+
+from .utils import tile2tile_np
+from .fetch import decode_image
+from .mapgen import calculate_coverage, _tile_grid, _channels, _convert_channels, _encode
+
+
+def build_pyramid(fetcher, geo1, geo2, lod, min_lod, provider=None, workers=None, batch_size=64, format='png',
+                  partial=False, overwrite=False, progress=False):
+    """
+        Derives the tiles of lower levels of detail from cached tiles by 2x2 downsampling of their children.
+        The tiles of lod must already be in the cache of the fetcher, levels are built from lod - 1 down to
+        min_lod and written back into the cache, each level is built from the previous one.
+        Batches of parents are decoded, downsampled and encoded in parallel (Pillow and numpy release the GIL).
+        :param fetcher: CachedFetcher holding the tiles.
+        :param geo1: Corner of the area, latitude and longitude in degrees.
+        :param geo2: Opposite corner of the area, latitude and longitude in degrees.
+        :param lod: Level of detail of the cached tiles.
+        :param min_lod: Lowest level of detail to build.
+        :param provider: Provider of the tiles, defaults to the provider of the fetcher.
+        :param workers: Number of threads to use.
+        :param batch_size: Number of parent tiles per batch.
+        :param format: Image format of the written tiles, 'png' or 'jpeg'.
+        :param partial: Whether to build parents with missing children, leaving their quarters black.
+        :param overwrite: Whether to rebuild parents that are already cached.
+        :param progress: Whether to show a progress bar.
+        :return: The number of tiles written.
+    """
+    if provider is None:
+        provider = fetcher.provider
+    written = 0
+    with ThreadPool(workers) as pool:
+        for level in range(lod - 1, min_lod - 1, -1):
+            tile_mn, tile_mx, _, _ = calculate_coverage(geo1, geo2, level)
+            parents = _tile_grid(tile_mn, tile_mx, level)
+            if not overwrite:
+                keys = fetcher.keys(parents, provider)
+                cached = np.array([fetcher.contains(pos, provider, key) for pos, key in zip(parents.tolist(), keys)],
+                                  dtype=bool)
+                parents = parents[~cached]
+            batches = [parents[i:i + batch_size] for i in range(0, len(parents), batch_size)]
+            build = lambda batch: _build_batch(fetcher, provider, batch, format, partial)
+            results = pool.imap_unordered(build, batches)
+            if progress:
+                from tqdm import tqdm
+                results = tqdm(results, total=len(batches), desc=f'LOD {level}')
+            written += sum(results)
+    fetcher.storage.flush()
+    return written
+
+
+def children_of(parents):
+    """
+        Returns the four children of each parent tile.
+        :param parents: Array of (x, y, lod) parent tiles, of shape (N, 3).
+        :return: Array of (x, y, lod) child tiles, of shape (N, 2, 2, 3), indexed by [parent, dy, dx].
+    """
+    parents = np.asarray(parents)
+    x, y, _ = tile2tile_np(parents[:, 0], parents[:, 1], parents[:, 2], parents[:, 2] + 1)
+    x = np.rint(x).astype(parents.dtype)
+    y = np.rint(y).astype(parents.dtype)
+    children = np.empty((len(parents), 2, 2, 3), dtype=parents.dtype)
+    children[..., 0] = x[:, None, None] + np.array([0, 1])[None, None, :]
+    children[..., 1] = y[:, None, None] + np.array([0, 1])[None, :, None]
+    children[..., 2] = parents[:, 2, None, None] + 1
+    return children
+
+
+def downsample(images):
+    """
+        Halves the size of a batch of images by averaging 2x2 blocks.
+        :param images: Array of shape (N, 2H, 2W) or (N, 2H, 2W, C).
+        :return: Array of shape (N, H, W) or (N, H, W, C) of the same dtype.
+    """
+    n, h, w = images.shape[:3]
+    blocks = images.reshape((n, h // 2, 2, w // 2, 2) + images.shape[3:])
+    total = blocks.sum(axis=(2, 4), dtype=np.uint32)
+    return ((total + 2) // 4).astype(images.dtype)
+
+
+def _build_batch(fetcher, provider, parents, format, partial):
+    children = children_of(parents)
+    tiles = [[[None, None], [None, None]] for _ in parents]
+    complete = np.ones(len(parents), dtype=bool)
+    channels = 1
+    keys = fetcher.keys(children.reshape(-1, 3), provider)
+    for (i, j, k), key in zip(np.ndindex(children.shape[:3]), keys):
+        cached = fetcher.get_raw(tuple(children[i, j, k].tolist()), provider, key)
+        if cached is None:
+            complete[i] = False
+            continue
+        tile = decode_image(cached[0])
+        channels = max(channels, _channels(tile))
+        tiles[i][j][k] = tile
+    keep = complete | (partial & np.array([any(t is not None for row in ts for t in row) for ts in tiles]))
+    if not keep.any():
+        return 0
+    size = next(t for ts in tiles for row in ts for t in row if t is not None).shape[:2]
+    shape = (int(keep.sum()), 2 * size[0], 2 * size[1]) + ((channels,) if channels != 1 else ())
+    mosaic = np.zeros(shape, dtype=np.uint8)
+    for n, i in enumerate(np.flatnonzero(keep)):
+        for j, k in np.ndindex(2, 2):
+            tile = tiles[i][j][k]
+            if tile is not None:
+                mosaic[n, j * size[0]:(j + 1) * size[0], k * size[1]:(k + 1) * size[1]] = \
+                    _convert_channels(tile, channels)
+    images = downsample(mosaic)
+    content_type = f'image/{format}'
+    for pos, image in zip(parents[keep].tolist(), images):
+        fetcher.store_raw(tuple(pos), _encode(image, format), content_type, provider)
+    return len(images)
+
+
+class FallbackFetcher:
+    """
+        Wraps a CachedFetcher and synthesizes the tiles it can not provide (missing from the cache with
+        only_cached=True, or failing to download) from other cached levels of detail: by downsampling
+        cached descendants up to max_down levels below, or else by cropping and upscaling the nearest
+        cached ancestor up to max_up levels above. If neither is cached, a black tile is returned when
+        blank is True, otherwise the original result (None or the error) is passed on.
+        Synthesized tiles are recorded in synthetic (and in the info of returned PIL images) so that they
+        can be fetched for real later with refine().
+    """
+
+    def __init__(self, fetcher, only_cached=False, max_up=8, max_down=1, blank=True):
+        self.fetcher = fetcher
+        self.provider = fetcher.provider
+        self.only_cached = only_cached
+        self.max_up = max_up
+        self.max_down = max_down
+        self.blank = blank
+        self.synthetic = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, pos, provider=None, only_cached=None, as_array=False):
+        if provider is None:
+            provider = self.provider
+        if only_cached is None:
+            only_cached = self.only_cached
+        pos = tuple(pos)
+        try:
+            image = self.fetcher(pos, provider, only_cached=only_cached, as_array=True)
+            error = None
+        except ValueError as e:
+            image, error = None, e
+        synthetic = image is None
+        if synthetic:
+            image = self.synthesize(pos, provider)
+            if image is None:
+                if error is not None:
+                    raise error
+                return None
+            with self.lock:
+                self.synthetic.add((provider, pos))
+        else:
+            with self.lock:
+                self.synthetic.discard((provider, pos))
+        if not as_array:
+            image = Image.fromarray(image)
+            image.info['synthetic'] = synthetic
+        return image
+
+    def fetch(self, pos, provider=None, only_cached=None, as_array=False):
+        return self(pos, provider, only_cached, as_array)
+
+    def is_synthetic(self, pos, provider=None):
+        if provider is None:
+            provider = self.provider
+        return (provider, tuple(pos)) in self.synthetic
+
+    def synthesize(self, pos, provider=None):
+        if provider is None:
+            provider = self.provider
+        x, y, z = map(int, pos)
+        for depth in range(1, self.max_down + 1):
+            image = self._from_descendants(x, y, z, depth, provider)
+            if image is not None:
+                return image
+        for depth in range(1, min(self.max_up, z) + 1):
+            image = self._from_ancestor(x, y, z, depth, provider)
+            if image is not None:
+                return image
+        if self.blank:
+            return np.zeros((256, 256, 3), dtype=np.uint8)
+        return None
+
+    def refine(self, workers=None):
+        """
+            Fetches the synthesized tiles for real.
+            :param workers: Number of threads to use.
+            :return: The (provider, pos) pairs that are still synthetic (failed to download).
+        """
+        with self.lock:
+            pending = list(self.synthetic)
+
+        def refine(item):
+            provider, pos = item
+            try:
+                self(pos, provider, only_cached=False, as_array=True)
+            except ValueError:
+                pass
+
+        with ThreadPool(workers) as pool:
+            pool.map(refine, pending)
+        with self.lock:
+            return set(self.synthetic)
+
+    def _cached(self, pos, provider):
+        return self.fetcher(pos, provider, only_cached=True, as_array=True)
+
+    def _from_descendants(self, x, y, z, depth, provider):
+        n = 1 << depth
+        tiles = []
+        for j in range(n):
+            for i in range(n):
+                tile = self._cached(((x << depth) + i, (y << depth) + j, z + depth), provider)
+                if tile is None:
+                    return None
+                tiles.append(tile)
+        channels = max(_channels(tile) for tile in tiles)
+        h, w = tiles[0].shape[:2]
+        mosaic = np.zeros((1, n * h, n * w) + ((channels,) if channels != 1 else ()), dtype=np.uint8)
+        for index, tile in enumerate(tiles):
+            j, i = divmod(index, n)
+            mosaic[0, j * h:(j + 1) * h, i * w:(i + 1) * w] = _convert_channels(tile, channels)
+        for _ in range(depth):
+            mosaic = downsample(mosaic)
+        return mosaic[0]
+
+    def _from_ancestor(self, x, y, z, depth, provider):
+        ancestor = self._cached((x >> depth, y >> depth, z - depth), provider)
+        if ancestor is None:
+            return None
+        n = 1 << depth
+        h, w = ancestor.shape[:2]
+        i, j = x & (n - 1), y & (n - 1)
+        crop = ancestor[j * h // n:(j + 1) * h // n, i * w // n:(i + 1) * w // n]
+        return np.array(Image.fromarray(crop).resize((w, h), Image.BILINEAR))
@@ -0,0 +1,131 @@
+import time
+import heapq
+import threading
+
+
+class CacheQuota:
+    """
+        Keeps a tile storage under a size and/or tile count quota by evicting tiles in a background thread.
+        The least recently used (policy='lru') or least frequently used (policy='lfu') tiles are evicted
+        until the storage is back under low_water times the quota. Access times start from the times the
+        storage reports when it is scanned (file times, or fetch times for SQLite), access counts are only tracked
+        within the process.
+    """
+
+    def __init__(self, storage, max_bytes=None, max_tiles=None, policy='lru', low_water=0.9, batch_size=256,
+                 interval=5.0):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'Unknown eviction policy {policy}')
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.max_tiles = max_tiles
+        self.policy = policy
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.interval = interval
+        self.entries = {}
+        self.nbytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, key, size):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.nbytes -= entry[0]
+                entry[0] = size
+                entry[1] = time.time()
+                entry[2] += 1
+            else:
+                self.entries[key] = [size, time.time(), 1]
+            self.nbytes += size
+        if self.over_quota():
+            self.event.set()
+
+    def touch(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry[1] = time.time()
+                entry[2] += 1
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry[0]
+
+    def over_quota(self, factor=1.0):
+        if self.max_bytes is not None and self.nbytes > self.max_bytes * factor:
+            return True
+        if self.max_tiles is not None and len(self.entries) > self.max_tiles * factor:
+            return True
+        return False
+
+    def evict(self):
+        while not self.closed and self.over_quota(self.low_water):
+            # victims are picked from a snapshot, so that fetch threads adding and touching tiles are not held up,
+            # taken as keys and values as a tuple per tile would set off the garbage collector under the lock
+            with self.lock:
+                keys, entries = list(self.entries), list(self.entries.values())
+            if self.policy == 'lru':
+                candidates = [(accessed, key) for key, (_, accessed, _) in zip(keys, entries)]
+            else:
+                candidates = [(count, accessed, key) for key, (_, accessed, count) in zip(keys, entries)]
+            heapq.heapify(candidates)
+            evicted = 0
+            while candidates and not self.closed and self.over_quota(self.low_water):
+                batch = [heapq.heappop(candidates) for _ in range(min(self.batch_size, len(candidates)))]
+                victims = []
+                with self.lock:
+                    for *_, accessed, key in batch:
+                        if not self.over_quota(self.low_water):
+                            break
+                        entry = self.entries.get(key)
+                        # tiles used since the snapshot are spared
+                        if entry is None or entry[1] != accessed:
+                            continue
+                        del self.entries[key]
+                        self.nbytes -= entry[0]
+                        victims.append(key)
+                self.storage.delete_many(victims)
+                self.evictions += len(victims)
+                evicted += len(victims)
+            if not evicted:
+                break
+
+    def _scan(self):
+        for key, size, accessed in self.storage.entries():
+            if self.closed:
+                return
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = [size, accessed, 0]
+                    self.nbytes += size
+
+    def _run(self):
+        self._scan()
+        while not self.closed:
+            self.evict()
+            self.event.wait(self.interval)
+            self.event.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tiles': len(self.entries),
+                'bytes': self.nbytes,
+                'max_tiles': self.max_tiles,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+    def close(self):
+        self.closed = True
+        self.event.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
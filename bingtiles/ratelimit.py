@@ -0,0 +1,95 @@
+import time
+import threading
+from urllib.parse import urlsplit
+
+
+class _Bucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.paused_until = 0.0
+
+
+class RateLimiter:
+    """
+        Token bucket rate limiter, shared by every thread and event loop downloading tiles.
+        Each host has a bucket refilled at rate requests per second and holding up to burst of them.
+        Hosts ending with a key of rates share one bucket with that rate instead, so that for example
+        {'virtualearth.net': 50} limits all Bing tile servers together. With rate None, other hosts are not limited.
+        Requests reserve their token up front, so acquire only returns how long the caller has to wait,
+        which lets threads sleep and coroutines await it without holding the lock.
+    """
+
+    def __init__(self, rate=None, burst=None, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = dict(rates) if rates else {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).hostname or ''
+        key, rate = host, self.rate
+        for suffix, suffix_rate in self.rates.items():
+            if host == suffix or host.endswith('.' + suffix):
+                key, rate = suffix, suffix_rate
+                break
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            burst = self.burst if self.burst is not None else max(1.0, rate or 1.0)
+            bucket = self.buckets[key] = _Bucket(rate, burst)
+        return bucket
+
+    def acquire(self, url):
+        """
+            Takes a token from the bucket of url.
+            :return: Seconds to wait before making the request.
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.bucket(url)
+            wait = bucket.paused_until - now
+            if bucket.rate is not None:
+                bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.last) * bucket.rate) - 1
+                bucket.last = now
+                if bucket.tokens < 0:
+                    wait = max(wait, -bucket.tokens / bucket.rate)
+        return max(0.0, wait)
+
+    def wait(self, url):
+        delay = self.acquire(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, url, seconds):
+        """
+            Holds back all requests to the bucket of url for the given number of seconds, e.g. after a 429.
+        """
+        until = time.monotonic() + seconds
+        with self.lock:
+            bucket = self.bucket(url)
+            bucket.paused_until = max(bucket.paused_until, until)
+
+
+def provider_rate_limiter(provider, rate, burst=None):
+    """
+        Rate limiter capping the requests to all tile servers of a provider together, e.g. to the four
+        ecn.t0-3.tiles.virtualearth.net servers of Bing, rather than to each of them.
+        :param provider: Provider whose servers are found from the URLs of the tiles of level 2.
+        :param rate: Requests per second to all the servers together.
+    """
+    hosts = {urlsplit(provider((x, y, 2))).hostname or '' for x in range(4) for y in range(4)}
+    labels = [host.split('.')[::-1] for host in hosts]
+    common = []
+    for label in zip(*labels):
+        if len(set(label)) > 1:
+            break
+        common.append(label[0])
+    if common:
+        return RateLimiter(burst=burst, rates={'.'.join(common[::-1]): rate})
+    return RateLimiter(rate / len(hosts), burst)
+
+
+default_rate_limiter = RateLimiter()
@@ -0,0 +1,58 @@
+import time
+import random
+from email.utils import parsedate_to_datetime
+
+
+class RetryPolicy:
+    """
+        When and how long to wait before retrying a failed tile request.
+        Delays grow exponentially from backoff up to max_backoff, with full jitter, so that workers that failed
+        together do not retry together. A Retry-After header of up to max_retry_after seconds is honored,
+        a longer one gives up at once.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, max_retry_after=120,
+                 statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.statuses = frozenset(statuses)
+
+    def should_retry(self, attempt, status=None):
+        """
+            :param status: HTTP status of the response, or None if the request failed with a connection error.
+        """
+        return attempt < self.retries and (status is None or status in self.statuses)
+
+    def delay(self, attempt, retry_after=None):
+        """
+            :return: Seconds to wait before the next attempt, or None if it should not be made.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+def parse_retry_after(value):
+    """
+        :param value: Value of a Retry-After header, either seconds or an HTTP date.
+        :return: Seconds to wait, or None if value is missing or malformed.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+default_retry_policy = RetryPolicy()
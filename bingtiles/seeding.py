@@ -0,0 +1,148 @@
+import os
+import json
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+import requests
+
+from .mapgen import calculate_coverage, _tile_grid
+from .provider import provider_name
+
+# errors of a single tile, which is counted as failed and retried on the next run
+FETCH_ERRORS = (ValueError, requests.RequestException, OSError)
+
+
+def read_bboxes(path):
+    """
+        Reads bounding boxes from a text file, one "lat1 lon1 lat2 lon2" per line (commas are also accepted).
+        Empty lines and lines starting with # are ignored.
+        :param path: Path of the file.
+        :return: A list of ((lat1, lon1), (lat2, lon2)) pairs.
+    """
+    bboxes = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].replace(',', ' ').split()
+            if not line:
+                continue
+            if len(line) != 4:
+                raise ValueError(f'Invalid bounding box: {" ".join(line)}')
+            lat1, lon1, lat2, lon2 = map(float, line)
+            bboxes.append(((lat1, lon1), (lat2, lon2)))
+    return bboxes
+
+
+def seed(fetcher, bboxes, min_lod, max_lod, provider=None, workers=16, chunk_size=1024, checkpoint=None,
+         progress=False, refresh=False, max_age=None):
+    """
+        Downloads every tile of the bounding boxes over a range of levels of detail into the cache of a fetcher.
+        Tiles already in the cache are skipped, or with refresh revalidated with conditional requests and rewritten
+        only if they changed. Failed downloads are counted and skipped. Tiles are processed
+        in chunks of chunk_size, chunks finished without failures are recorded in the checkpoint file so an
+        interrupted run resumes where it stopped. The checkpoint also records the job (bounding boxes, levels
+        of detail, provider and chunk size) and can only be resumed by the same job.
+        :param fetcher: CachedFetcher to fill.
+        :param bboxes: List of ((lat1, lon1), (lat2, lon2)) pairs.
+        :param min_lod: Lowest level of detail.
+        :param max_lod: Highest level of detail.
+        :param provider: Provider of the tiles, defaults to the provider of the fetcher.
+        :param workers: Number of download threads.
+        :param chunk_size: Number of tiles per checkpointed chunk.
+        :param checkpoint: Path of the checkpoint file, or None. A ValueError is raised if it is of another job.
+        :param progress: Whether to show a progress bar.
+        :param refresh: Whether to revalidate the cached tiles.
+        :param max_age: Seconds since the last fetch within which cached tiles are not revalidated.
+        :return: A dict of statistics (tiles, fetched, cached, failed, unchanged, changed, bytes, seconds,
+            tiles_per_second, mb_per_second). With refresh, cached counts the tiles within max_age.
+            tiles_per_second counts the tiles fetched or revalidated, not the ones skipped.
+    """
+    if provider is None:
+        provider = fetcher.provider
+    try:
+        name = provider_name(provider)
+    except ValueError:
+        # unnamed providers can only be stored by URL, which also tells them apart
+        name = provider((0, 0, 1))
+    job = {
+        'bboxes': [[*map(float, geo1), *map(float, geo2)] for geo1, geo2 in bboxes],
+        'min_lod': min_lod,
+        'max_lod': max_lod,
+        'provider': name,
+        'chunk_size': chunk_size,
+    }
+    done = set()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+        if state.get('job') != job:
+            raise ValueError(f'Checkpoint {checkpoint} is of another seed job, remove it to start over')
+        done = set(state['done'])
+    chunks = []
+    for i, (geo1, geo2) in enumerate(bboxes):
+        for lod in range(min_lod, max_lod + 1):
+            tile_mn, tile_mx, _, _ = calculate_coverage(geo1, geo2, lod)
+            poses = _tile_grid(tile_mn, tile_mx, lod)
+            for j in range(0, len(poses), chunk_size):
+                chunks.append((f'{i}:{lod}:{j // chunk_size}', poses[j:j + chunk_size]))
+    total = sum(len(poses) for _, poses in chunks)
+    stats = {'tiles': total, 'fetched': 0, 'cached': 0, 'failed': 0, 'unchanged': 0, 'changed': 0, 'bytes': 0}
+
+    def fetch(args):
+        pos, key = args
+        pos = tuple(pos)
+        if fetcher.contains(pos, provider, key):
+            if not refresh:
+                return 'cached', 0
+            try:
+                status = fetcher.refresh(pos, provider, max_age)
+            except FETCH_ERRORS:
+                return 'failed', 0
+            return 'cached' if status == 'fresh' else status, 0
+        try:
+            content = fetcher(pos, provider, as_raw=True, key=key)
+        except FETCH_ERRORS:
+            return 'failed', 0
+        return 'fetched', len(content)
+
+    bar = None
+    if progress:
+        from tqdm import tqdm
+        bar = tqdm(total=total, unit='tile')
+    start = time.perf_counter()
+    with ThreadPool(workers) as pool:
+        for key, poses in chunks:
+            if key in done:
+                stats['cached'] += len(poses)
+                if bar is not None:
+                    bar.update(len(poses))
+                continue
+            tasks = zip(poses.tolist(), fetcher.keys(poses, provider))
+            failed = stats['failed']
+            for status, size in pool.imap_unordered(fetch, tasks):
+                stats[status] += 1
+                stats['bytes'] += size
+                if bar is not None:
+                    bar.update()
+                    elapsed = time.perf_counter() - start
+                    bar.set_postfix_str(f'{stats["bytes"] / elapsed / 1e6:.2f} MB/s', refresh=False)
+            fetcher.storage.flush()
+            if stats['failed'] > failed:
+                continue
+            done.add(key)
+            if checkpoint is not None:
+                _write_checkpoint(checkpoint, job, done)
+    if bar is not None:
+        bar.close()
+    stats['seconds'] = time.perf_counter() - start
+    # tiles skipped as cached or in finished chunks took no requests, the rate is of the tiles requested
+    requested = stats['fetched'] + stats['unchanged'] + stats['changed']
+    stats['tiles_per_second'] = requested / max(stats['seconds'], 1e-9)
+    stats['mb_per_second'] = stats['bytes'] / max(stats['seconds'], 1e-9) / 1e6
+    return stats
+
+
+def _write_checkpoint(path, job, done):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'job': job, 'done': sorted(done)}, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,73 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    """
+        Keep-alive HTTP sessions, one per host, shared between threads.
+        Each session keeps up to pool_size open connections to its host, so it should be
+        at least as large as the number of workers fetching from it concurrently.
+    """
+
+    def __init__(self, pool_size=None, timeout=10, headers=None):
+        if pool_size is None:
+            pool_size = os.cpu_count() or 1
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.headers = dict(headers) if headers else {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        host = urlsplit(url).netloc
+        session = self.sessions.get(host)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(host)
+                if session is None:
+                    session = self._new_session()
+                    self.sessions[host] = session
+        return session
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    def resize(self, pool_size):
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            # live sessions are replaced rather than remounted, as other threads may be looking up their adapters,
+            # requests in flight keep their connection, which is closed when returned to the closed pool
+            replaced = self.sessions
+            self.sessions = {host: self._new_session() for host in replaced}
+        for session in replaced.values():
+            session.close()
+
+    def _new_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+default_session_pool = SessionPool()
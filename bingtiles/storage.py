@@ -0,0 +1,498 @@
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+
+from .provider import provider_name, provider_urls, parse_url
+
+
+EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpeg',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+MAGIC_NUMBERS = {
+    b'\x89PNG': 'image/png',
+    b'\xff\xd8': 'image/jpeg',
+    b'RIFF': 'image/webp',
+    b'GIF8': 'image/gif',
+}
+
+
+def _rows(poses):
+    # positions as lists of Python ints, as sqlite3 can not bind numpy integers
+    if hasattr(poses, 'tolist'):
+        return poses.tolist()
+    return [list(map(int, pos)) for pos in poses]
+
+
+def guess_content_type(content, content_type=None):
+    if content_type is not None:
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type in EXTENSIONS:
+            return content_type
+    for magic, content_type in MAGIC_NUMBERS.items():
+        if content.startswith(magic):
+            return content_type
+    raise ValueError('Unknown tile image format')
+
+
+class TileStorage:
+    """
+        Interface of the tile stores behind CachedFetcher.
+        key() maps a provider and a tile position to a key that is only meaningful to the storage itself,
+        the other methods take such keys. Stored values are the encoded tile bytes and their content type.
+        Tiles may also carry metadata, a dict of the HTTP validators 'etag' and 'last_modified' of the response
+        they came from and the 'fetched' time (seconds since the epoch) they were downloaded or last revalidated.
+    """
+
+    def key(self, provider, pos):
+        raise NotImplementedError
+
+    def keys(self, provider, poses):
+        """
+            Batch version of key.
+            :param poses: Array-like of shape (N, 3) of tile positions.
+            :return: A list of N keys.
+        """
+        return [self.key(provider, pos) for pos in _rows(poses)]
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, content, content_type, meta=None):
+        raise NotImplementedError
+
+    def get_meta(self, key):
+        """
+            :return: The metadata dict of the tile, or None if the tile is not stored.
+        """
+        return {} if self.contains(key) else None
+
+    def put_meta(self, key, meta):
+        """
+            Updates the metadata of a stored tile without rewriting it.
+        """
+        pass
+
+    def contains(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def entries(self):
+        """
+            Iterates over the stored tiles.
+            :return: An iterator of (key, size in bytes, last access or modification time) tuples.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DirectoryStorage(TileStorage):
+    """
+        One file per tile in a flat directory, named by the urlsafe base64 of the tile URL.
+        The file extension records the content type.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def key(self, provider, pos):
+        url = provider(pos)
+        return base64.urlsafe_b64encode(url.encode('utf-8')).decode('utf-8')
+
+    def keys(self, provider, poses):
+        encode = base64.urlsafe_b64encode
+        return [encode(url.encode('utf-8')).decode('utf-8') for url in provider_urls(provider, poses)]
+
+    def find(self, key):
+        base_path = os.path.join(self.path, key)
+        for extension in EXTENSIONS.values():
+            if os.path.exists(base_path + extension):
+                return base_path + extension
+        return None
+
+    def get(self, key):
+        file_path = self.find(key)
+        if file_path is None:
+            return None
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        extension = os.path.splitext(file_path)[1]
+        content_type = next(k for k, v in EXTENSIONS.items() if v == extension)
+        return content, content_type
+
+    def contains(self, key):
+        return self.find(key) is not None
+
+    def put(self, key, content, content_type, meta=None):
+        extension = EXTENSIONS[guess_content_type(content, content_type)]
+        file_path = os.path.join(self.path, key + extension)
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        self._write_meta(key, file_path, {} if meta is None else meta)
+
+    def get_meta(self, key):
+        # the fetch time is the modification time of the tile file, validators are kept in a .json next to it
+        file_path = self.find(key)
+        if file_path is None:
+            return None
+        try:
+            with open(os.path.join(self.path, key + '.json')) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            meta = {}
+        try:
+            meta['fetched'] = os.stat(file_path).st_mtime
+        except FileNotFoundError:
+            return None
+        return meta
+
+    def put_meta(self, key, meta):
+        file_path = self.find(key)
+        if file_path is not None:
+            self._write_meta(key, file_path, meta)
+
+    def _write_meta(self, key, file_path, meta):
+        validators = {name: meta[name] for name in ('etag', 'last_modified') if meta.get(name) is not None}
+        meta_path = os.path.join(self.path, key + '.json')
+        if validators:
+            with open(meta_path, 'w') as f:
+                json.dump(validators, f)
+        elif os.path.exists(meta_path):
+            os.remove(meta_path)
+        fetched = meta.get('fetched')
+        if fetched is not None:
+            os.utime(file_path, (time.time(), fetched))
+
+    def delete(self, key):
+        file_path = self.find(key)
+        if file_path is not None:
+            try:
+                os.remove(file_path)
+                os.remove(os.path.join(self.path, key + '.json'))
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        for root, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                key, extension = os.path.splitext(file_name)
+                if extension not in EXTENSIONS.values():
+                    continue
+                file_path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                key = os.path.relpath(os.path.join(root, key), self.path)
+                yield key, stat.st_size, max(stat.st_atime, stat.st_mtime)
+
+
+class ShardedStorage(DirectoryStorage):
+    """
+        One file per tile under <provider>/<z>/<x>/<y>, keyed on the provider name instead of the URL,
+        so the cache survives changes of the provider URLs.
+    """
+
+    def key(self, provider, pos):
+        x, y, z = map(int, pos)
+        name = re.sub(r'[^\w.-]', '_', provider_name(provider))
+        return os.path.join(name, str(z), str(x), str(y))
+
+    def keys(self, provider, poses):
+        name = re.sub(r'[^\w.-]', '_', provider_name(provider))
+        return [os.path.join(name, str(z), str(x), str(y)) for x, y, z in _rows(poses)]
+
+    def put(self, key, content, content_type, meta=None):
+        directory = os.path.dirname(os.path.join(self.path, key))
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        super().put(key, content, content_type, meta)
+
+
+class SQLiteStorage(TileStorage):
+    """
+        All tiles in a single SQLite file, keyed on (provider, z, x, y).
+        The file is MBTiles-compatible: the tiles view exposes the tiles of the provider named in the metadata
+        table with TMS row numbering. Readers use one connection per thread on a WAL journal, writes are
+        buffered and committed in batches of batch_size.
+    """
+
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}
+        self.pending_meta = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.writer = sqlite3.connect(path, check_same_thread=False)
+        self.writer.execute('PRAGMA journal_mode=WAL')
+        self.writer.execute('PRAGMA synchronous=NORMAL')
+        self.writer.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tile_store (
+                provider TEXT NOT NULL,
+                zoom_level INTEGER NOT NULL,
+                tile_column INTEGER NOT NULL,
+                tile_row INTEGER NOT NULL,
+                tile_data BLOB NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched REAL,
+                PRIMARY KEY (provider, zoom_level, tile_column, tile_row)
+            ) WITHOUT ROWID;
+            CREATE VIEW IF NOT EXISTS tiles AS
+                SELECT zoom_level, tile_column, (1 << zoom_level) - 1 - tile_row AS tile_row, tile_data
+                FROM tile_store WHERE provider = (SELECT value FROM metadata WHERE name = 'name');
+        ''')
+        columns = {row[1] for row in self.writer.execute('PRAGMA table_info(tile_store)')}
+        for column, column_type in (('etag', 'TEXT'), ('last_modified', 'TEXT'), ('fetched', 'REAL')):
+            if column not in columns:
+                self.writer.execute(f'ALTER TABLE tile_store ADD COLUMN {column} {column_type}')
+        self.writer.commit()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            self.local.connection = connection
+        return connection
+
+    def key(self, provider, pos):
+        x, y, z = map(int, pos)
+        return provider_name(provider), z, x, y
+
+    def keys(self, provider, poses):
+        name = provider_name(provider)
+        return [(name, z, x, y) for x, y, z in _rows(poses)]
+
+    def get(self, key):
+        with self.lock:
+            value = self.pending.get(key)
+        if value is not None:
+            return value[:2]
+        row = self._connection().execute(
+            'SELECT tile_data, content_type FROM tile_store '
+            'WHERE provider = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', key).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), row[1]
+
+    def contains(self, key):
+        with self.lock:
+            if key in self.pending:
+                return True
+        row = self._connection().execute(
+            'SELECT 1 FROM tile_store '
+            'WHERE provider = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ? LIMIT 1', key).fetchone()
+        return row is not None
+
+    def put(self, key, content, content_type, meta=None):
+        content_type = guess_content_type(content, content_type)
+        if meta is None:
+            meta = {'fetched': time.time()}
+        with self.lock:
+            self.pending_meta.pop(key, None)
+            self.pending[key] = (content, content_type, meta)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def get_meta(self, key):
+        with self.lock:
+            meta = self.pending_meta.get(key)
+            if meta is None and key in self.pending:
+                meta = self.pending[key][2]
+        if meta is not None:
+            return dict(meta)
+        row = self._connection().execute(
+            'SELECT etag, last_modified, fetched FROM tile_store '
+            'WHERE provider = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', key).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'fetched': row[2]}
+
+    def put_meta(self, key, meta):
+        with self.lock:
+            if key in self.pending:
+                content, content_type, _ = self.pending[key]
+                self.pending[key] = (content, content_type, meta)
+                return
+            self.pending_meta[key] = meta
+            if len(self.pending_meta) >= self.batch_size:
+                self._flush()
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.pending.pop(key, None)
+                self.pending_meta.pop(key, None)
+            with self.writer:
+                self.writer.executemany(
+                    'DELETE FROM tile_store '
+                    'WHERE provider = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', keys)
+
+    def entries(self):
+        self.flush()
+        # the fetch time stands in for the last access, which is not recorded
+        rows = self._connection().execute(
+            'SELECT provider, zoom_level, tile_column, tile_row, length(tile_data), coalesce(fetched, 0) '
+            'FROM tile_store')
+        for provider, z, x, y, size, fetched in rows:
+            yield (provider, z, x, y), size, fetched
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pending_meta:
+            rows = [(meta.get('etag'), meta.get('last_modified'), meta.get('fetched'), *key)
+                    for key, meta in self.pending_meta.items()]
+            with self.writer:
+                self.writer.executemany(
+                    'UPDATE tile_store SET etag = ?, last_modified = ?, fetched = ? '
+                    'WHERE provider = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', rows)
+            self.pending_meta.clear()
+        if not self.pending:
+            return
+        rows = [(*key, content, content_type, meta.get('etag'), meta.get('last_modified'), meta.get('fetched'))
+                for key, (content, content_type, meta) in self.pending.items()]
+        with self.writer:
+            self.writer.execute(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES ('name', ?)", (rows[0][0],))
+            self.writer.execute(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES ('format', ?)",
+                (EXTENSIONS[rows[0][5]][1:].replace('jpeg', 'jpg'),))
+            self.writer.executemany(
+                'INSERT OR REPLACE INTO tile_store '
+                '(provider, zoom_level, tile_column, tile_row, tile_data, content_type, etag, last_modified, fetched) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.writer.close()
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+SQLITE_EXTENSIONS = ('.mbtiles', '.sqlite', '.sqlite3', '.db')
+
+
+def open_storage(path, layout=None):
+    """
+        Opens the tile storage at path.
+        :param path: Directory or SQLite file of the cache.
+        :param layout: 'sqlite', 'flat' (base64 URL file names) or 'sharded' (<provider>/<z>/<x>/<y>).
+            If None, it is detected from the path, new directories use the sharded layout.
+        :return: The storage.
+    """
+    if layout is None:
+        layout = detect_layout(path)
+    if layout == 'sqlite':
+        return SQLiteStorage(path)
+    elif layout == 'flat':
+        return DirectoryStorage(path)
+    elif layout == 'sharded':
+        return ShardedStorage(path)
+    raise ValueError(f'Unknown cache layout {layout}')
+
+
+def detect_layout(path):
+    if path.lower().endswith(SQLITE_EXTENSIONS) or os.path.isfile(path):
+        return 'sqlite'
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1] in EXTENSIONS.values():
+                    return 'flat'
+    return 'sharded'
+
+
+def migrate_cache(source, destination, workers=None, remove=False, default_name=None, progress=False):
+    """
+        Converts a flat cache of base64 URL file names into another storage.
+        The provider and tile of each file is recovered from its URL. Files whose tile is recovered but
+        whose provider is ambiguous are stored under default_name, the others are skipped.
+        :param source: Directory of the flat cache.
+        :param destination: Path of the new cache or a TileStorage.
+        :param workers: Number of threads to use.
+        :param remove: Whether to remove the migrated files from the source.
+        :param default_name: Provider name for the URLs that can not be attributed to a known provider.
+        :param progress: Whether to show a progress bar.
+        :return: The number of migrated and skipped files.
+    """
+    if isinstance(destination, str):
+        destination = open_storage(destination)
+    file_names = [entry.name for entry in os.scandir(source)
+                  if entry.is_file() and os.path.splitext(entry.name)[1] in EXTENSIONS.values()]
+
+    def migrate(file_name):
+        key, extension = os.path.splitext(file_name)
+        try:
+            url = base64.urlsafe_b64decode(key.encode('utf-8')).decode('utf-8')
+        except ValueError:
+            return None
+        parsed = parse_url(url)
+        if parsed is None:
+            return None
+        name, pos = parsed
+        if name is None:
+            if default_name is None:
+                return None
+            name = default_name
+        file_path = os.path.join(source, file_name)
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        content_type = next(k for k, v in EXTENSIONS.items() if v == extension)
+        destination.put(destination.key(name, pos), content, content_type)
+        return file_path
+
+    with ThreadPool(workers) as pool:
+        results = pool.imap_unordered(migrate, file_names, chunksize=64)
+        if progress:
+            from tqdm import tqdm
+            results = tqdm(results, total=len(file_names))
+        migrated = [file_path for file_path in results if file_path]
+    # sources are only removed once the destination has committed their tiles
+    destination.flush()
+    if remove:
+        for file_path in migrated:
+            os.remove(file_path)
+    return len(migrated), len(file_names) - len(migrated)
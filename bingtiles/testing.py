@@ -0,0 +1,203 @@
+import io
+import time
+import zlib
+import random
+import threading
+from collections import Counter
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image
+
+from .provider import provider_name
+
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+
+HEAVY_MODULES = ['numpy', 'PIL', 'requests', 'tqdm', 'aiohttp', 'cv2']
+
+# entry points of the package, each run in a fresh interpreter, and the heavy modules they may import
+IMPORT_CASES = {
+    'import': ('import bingtiles', []),
+    'provider': ("from bingtiles.provider import providers; providers['bing_aerial']((0, 0, 1))", ['numpy']),
+    'fetch': ('from bingtiles import CachedFetcher', ['numpy', 'PIL', 'requests']),
+    'mapgen': ('from bingtiles import generate_map', ['numpy', 'PIL', 'requests']),
+    'cli': ("import sys; sys.argv = ['bingtiles', 'tile', '--help']\n"
+            "from bingtiles.__main__ import main\n"
+            "try:\n    main()\nexcept SystemExit:\n    pass", []),
+}
+
+
+def make_tiles(count=64, format='jpeg', tile_size=256, seed=0):
+    """
+        Encodes count distinct tiles looking roughly like imagery (smooth gradients with noise),
+        so that their sizes and decoding costs are realistic.
+    """
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:tile_size, 0:tile_size] / tile_size
+    tiles = []
+    for _ in range(count):
+        a, b, c = rng.uniform(0, 255, 3)
+        base = a * xs + b * ys + c * xs * ys
+        image = np.stack([base, base[::-1], base[:, ::-1]], axis=2) % 256
+        image += rng.normal(0, 12, image.shape)
+        image = np.clip(image, 0, 255).astype(np.uint8)
+        f = io.BytesIO()
+        Image.fromarray(image).save(f, format=format)
+        tiles.append(f.getvalue())
+    return tiles
+
+
+def tile_content(path, format='png', size=256):
+    """
+        Encodes a tile filled with a color derived from path, so that every tile of a mosaic can be told apart.
+    """
+    crc = zlib.crc32(path.encode())
+    color = [(crc >> shift) & 0xff for shift in (0, 8, 16)]
+    f = io.BytesIO()
+    Image.fromarray(np.full((size, size, 3), color, np.uint8)).save(f, format=format)
+    return f.getvalue()
+
+
+class TileServer:
+    """
+        Local HTTP server standing in for the tile providers, for the tests and benchmarks.
+        Every path gets one of a fixed set of pre-encoded tiles, chosen by a hash of the path, or with distinct
+        its own tile_content. Tiles are sent with an ETag and Last-Modified, conditional requests matching them
+        get 304 with the ETag only, unless validators is False, and increasing revision changes every tile.
+        Responses are delayed by latency plus a uniform jitter, and fail with 503 at error_rate.
+        Requests are counted in total and in flight per Host header, so that the number of requests a fetcher
+        keeps open against each host can be checked. Use provider() to point a provider URL builder at the server.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, format='jpeg', tile_size=256, seed=0,
+                 distinct=False, validators=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.format = format
+        self.tile_size = tile_size
+        self.content_type = CONTENT_TYPES[format]
+        self.tiles = None if distinct else make_tiles(format=format, tile_size=tile_size, seed=seed)
+        self.validators = validators
+        self.revision = 0
+        self.modified = int(time.time())
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.max_total = 0
+        self.errors = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def content(self, path):
+        """
+            :return: The tile the server sends for path at the current revision.
+        """
+        if self.tiles is None:
+            return tile_content(f'{path}#{self.revision}' if self.revision else path, self.format, self.tile_size)
+        return self.tiles[(zlib.crc32(path.encode()) + self.revision) % len(self.tiles)]
+
+    def handle(self, request):
+        host = request.headers.get('Host')
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            error = self.random.random() < self.error_rate
+            self.requests[host] += 1
+            self.in_flight[host] += 1
+            self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+            self.max_total = max(self.max_total, sum(self.in_flight.values()))
+            self.errors += error
+        if delay > 0:
+            time.sleep(delay)
+        content = self.content(request.path)
+        etag = f'"{zlib.crc32(content):08x}"'
+        last_modified = formatdate(self.modified + self.revision, usegmt=True)
+        not_modified = self.validators and (request.headers.get('If-None-Match') == etag or (
+            request.headers.get('If-None-Match') is None and request.headers.get('If-Modified-Since') == last_modified))
+        # counted out before responding, as the client may send its next request as soon as it has the response
+        with self.lock:
+            self.in_flight[host] -= 1
+            self.not_modified += not error and not_modified
+            self.bytes += 0 if error or not_modified else len(content)
+        if error:
+            request.send_response(503)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        request.send_response(304 if not_modified else 200)
+        if self.validators:
+            request.send_header('ETag', etag)
+        if not_modified:
+            request.end_headers()
+            return
+        if self.validators:
+            request.send_header('Last-Modified', last_modified)
+        request.send_header('Content-Type', self.content_type)
+        request.send_header('Content-Length', str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+    def provider(self, provider, hosts=('127.0.0.1',)):
+        """
+            Wraps a provider so that its URLs point at this server, keeping the original host in the path.
+            Tiles are spread over hosts by their X coordinate, all of them have to resolve to this machine.
+            The wrapper has the name of the provider, so that it is cached under the same name.
+        """
+        def local(pos):
+            url = urlsplit(provider(pos))
+            query = '?' + url.query if url.query else ''
+            return f'http://{hosts[pos[0] % len(hosts)]}:{self.port}/{url.netloc}{url.path}{query}'
+
+        local.__name__ = provider_name(provider)
+        return local
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.max_in_flight.clear()
+            self.max_total = 0
+            self.errors = 0
+            self.not_modified = 0
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'requests': sum(self.requests.values()), 'errors': self.errors,
+                    'not_modified': self.not_modified, 'bytes': self.bytes}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
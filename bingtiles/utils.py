@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 EARTH_RADIUS = 6378137
 MIN_LATITUDE = -85.05112878
 MAX_LATITUDE = 85.05112878
@@ -216,6 +218,152 @@ def quad2tile(quad_key):
     return tile_x, tile_y, level_of_detail
 
 
+def _part1by1(n):
+    """
+        Spreads the lower 32 bits of each number so that there is a zero bit between each of them.
+        :param n: Array of unsigned integers.
+        :return: Array of uint64 with the bits of n at the even positions.
+    """
+    n = np.asarray(n, dtype=np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    n = (n | (n << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    n = (n | (n << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    n = (n | (n << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    n = (n | (n << np.uint64(2))) & np.uint64(0x3333333333333333)
+    n = (n | (n << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return n
+
+
+def _compact1by1(n):
+    """
+        Inverse of _part1by1, gathers the bits at the even positions into the lower 32 bits.
+        :param n: Array of uint64.
+        :return: Array of uint64.
+    """
+    n = np.asarray(n, dtype=np.uint64) & np.uint64(0x5555555555555555)
+    n = (n | (n >> np.uint64(1))) & np.uint64(0x3333333333333333)
+    n = (n | (n >> np.uint64(2))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    n = (n | (n >> np.uint64(4))) & np.uint64(0x00FF00FF00FF00FF)
+    n = (n | (n >> np.uint64(8))) & np.uint64(0x0000FFFF0000FFFF)
+    n = (n | (n >> np.uint64(16))) & np.uint64(0x00000000FFFFFFFF)
+    return n
+
+
+def _bit_length(n):
+    """
+        Vectorized int.bit_length for uint64 arrays.
+        :param n: Array of uint64.
+        :return: Array of the number of bits needed to represent each number.
+    """
+    n = np.array(n, dtype=np.uint64)
+    length = np.zeros(n.shape, dtype=np.uint64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        shift = np.uint64(shift)
+        mask = (n >> shift) != 0
+        length[mask] += shift
+        n[mask] >>= shift
+    return length + (n != 0)
+
+
+def tile2quadint(tile_x, tile_y, level_of_detail):
+    """
+        Converts tile XY coordinates into an integer QuadKey, broadcasting over numpy arrays.
+        The integer QuadKey holds the QuadKey digits as a base-4 number (the bits of tile_x and tile_y
+        interleaved in Morton order) behind a leading 1 bit marking the level of detail. It is unique
+        across levels of detail and sorts tiles of one level in QuadKey order.
+        :param tile_x: Tile X coordinate.
+        :param tile_y: Tile Y coordinate.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :return: The integer QuadKey as uint64.
+    """
+    level_of_detail = np.asarray(level_of_detail, dtype=np.uint64)
+    morton = _part1by1(tile_x) | (_part1by1(tile_y) << np.uint64(1))
+    return morton | (np.uint64(1) << (np.uint64(2) * level_of_detail))
+
+
+def quadint2tile(quad_int):
+    """
+        Converts an integer QuadKey into tile XY coordinates, broadcasting over numpy arrays.
+        :param quad_int: Integer QuadKey, as returned by tile2quadint.
+        :return: The tile X and Y coordinates and the level of detail.
+    """
+    quad_int = np.asarray(quad_int, dtype=np.uint64)
+    level_of_detail = (_bit_length(quad_int) - np.uint64(1)) >> np.uint64(1)
+    morton = quad_int ^ (np.uint64(1) << (np.uint64(2) * level_of_detail))
+    tile_x = _compact1by1(morton)
+    tile_y = _compact1by1(morton >> np.uint64(1))
+    return tile_x, tile_y, level_of_detail
+
+
+def quadint2quad(quad_int):
+    """
+        Converts integer QuadKeys into QuadKey strings.
+        :param quad_int: Integer QuadKey or array of them.
+        :return: A string containing the QuadKey, or an array of them.
+    """
+    quad_int = np.asarray(quad_int, dtype=np.uint64)
+    flat = quad_int.reshape(-1)
+    level_of_detail = (_bit_length(flat) - np.uint64(1)) >> np.uint64(1)
+    max_level = int(level_of_detail.max(initial=0))
+    quad_keys = np.empty(flat.shape, dtype=f'<U{max(max_level, 1)}')
+    for level in np.unique(level_of_detail):
+        mask = level_of_detail == level
+        if level == 0:
+            quad_keys[mask] = ''
+            continue
+        shifts = np.arange(2 * int(level) - 2, -1, -2, dtype=np.uint64)
+        digits = ((flat[mask][:, None] >> shifts) & np.uint64(3)).astype(np.uint8) + ord('0')
+        quad_keys[mask] = np.ascontiguousarray(digits).view(f'S{int(level)}').ravel().astype(str)
+    if quad_int.ndim == 0:
+        return str(quad_keys[0])
+    return quad_keys.reshape(quad_int.shape)
+
+
+def quad2quadint(quad_key):
+    """
+        Converts QuadKey strings into integer QuadKeys.
+        :param quad_key: QuadKey string or array-like of them.
+        :return: The integer QuadKey as uint64, or an array of them.
+    """
+    if isinstance(quad_key, str):
+        if quad_key.strip('0123') != '':
+            raise Exception('Invalid QuadKey digit sequence.')
+        return np.uint64(int(quad_key or '0', 4) | (1 << (2 * len(quad_key))))
+    quad_key = np.asarray(quad_key, dtype=bytes)
+    shape = quad_key.shape
+    quad_key = quad_key.reshape(-1)
+    width = quad_key.dtype.itemsize
+    chars = quad_key.view(np.uint8).reshape(len(quad_key), width)
+    present = chars != 0
+    digits = chars.astype(np.int64) - ord('0')
+    if np.any(present & ((digits < 0) | (digits > 3))):
+        raise Exception('Invalid QuadKey digit sequence.')
+    quad_int = np.ones(len(quad_key), dtype=np.uint64)
+    for i in range(width):
+        column = present[:, i]
+        quad_int[column] = (quad_int[column] << np.uint64(2)) | digits[column, i].astype(np.uint64)
+    return quad_int.reshape(shape)
+
+
+def tile2quad_np(tile_x, tile_y, level_of_detail):
+    """
+        Vectorized version of tile2quad, broadcasting over numpy arrays.
+        :param tile_x: Tile X coordinates.
+        :param tile_y: Tile Y coordinates.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :return: An array of strings containing the QuadKeys.
+    """
+    return quadint2quad(tile2quadint(tile_x, tile_y, level_of_detail))
+
+
+def quad2tile_np(quad_key):
+    """
+        Vectorized version of quad2tile.
+        :param quad_key: Array-like of QuadKey strings.
+        :return: The tile X and Y coordinates and the levels of detail.
+    """
+    return quadint2tile(quad2quadint(quad_key))
+
+
 def get_server_num(tile_x, tile_y, max_server_num=4):
     """
         Returns a server number for a given tile.
@@ -225,3 +373,122 @@ def get_server_num(tile_x, tile_y, max_server_num=4):
         :return: A server number.
     """
     return (tile_x + 2 * tile_y) % max_server_num
+
+
+_exact_ufuncs = {name: np.frompyfunc(getattr(math, name), 1, 1) for name in ('sin', 'log', 'atan', 'exp')}
+
+
+def _transcendental(name, exact):
+    """
+        Returns an element-wise version of a transcendental function.
+        :param name: Name of the function in both math and numpy.
+        :param exact: Whether to evaluate with math (bit-for-bit identical to the scalar functions)
+            or with the numpy ufunc (faster, but may differ in the last few ulps on some CPUs).
+        :return: A function accepting and returning float64 arrays.
+    """
+    if not exact:
+        return getattr(np, name)
+    func = _exact_ufuncs[name]
+    return lambda x: np.asarray(func(x), dtype=np.float64)
+
+
+def geodetic2pixel_np(latitude, longitude, level_of_detail, exact=True):
+    """
+        Vectorized version of geodetic2pixel, broadcasting over numpy arrays.
+        :param latitude: Latitudes of the points, in degrees.
+        :param longitude: Longitudes of the points, in degrees.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param exact: Match the scalar function bit-for-bit instead of using the numpy ufuncs.
+        :return: The pixel coordinates in pixels.
+    """
+    sin = _transcendental('sin', exact)
+    log = _transcendental('log', exact)
+    latitude = np.clip(np.asarray(latitude, dtype=np.float64), MIN_LATITUDE, MAX_LATITUDE)
+    longitude = np.clip(np.asarray(longitude, dtype=np.float64), MIN_LONGITUDE, MAX_LONGITUDE)
+
+    x = (longitude + 180) / 360
+    sin_latitude = sin(latitude * math.pi / 180)
+    y = 0.5 - log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+
+    map_size_ = get_map_size(np.asarray(level_of_detail))
+    pixel_x = np.clip(x * map_size_ + 0.5, 0, map_size_ - 1)
+    pixel_y = np.clip(y * map_size_ + 0.5, 0, map_size_ - 1)
+    return pixel_x, pixel_y, level_of_detail
+
+
+def pixel2geodetic_np(pixel_x, pixel_y, level_of_detail, exact=True):
+    """
+        Vectorized version of pixel2geodetic, broadcasting over numpy arrays.
+        :param pixel_x: X coordinates of the points, in pixels.
+        :param pixel_y: Y coordinates of the points, in pixels.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param exact: Match the scalar function bit-for-bit instead of using the numpy ufuncs.
+        :return: The latitudes and longitudes of the specified pixels in degrees.
+    """
+    atan = _transcendental('atan', exact)
+    exp = _transcendental('exp', exact)
+    map_size_ = get_map_size(np.asarray(level_of_detail))
+    x = (np.clip(pixel_x, 0, map_size_ - 1) / map_size_) - 0.5
+    y = 0.5 - (np.clip(pixel_y, 0, map_size_ - 1) / map_size_)
+
+    latitude = 90 - 360 * atan(exp(-y * 2 * math.pi)) / math.pi
+    longitude = 360 * x
+    return latitude, longitude
+
+
+def pixel2pixel_np(pixel_x, pixel_y, level_of_detail, new_level_of_detail):
+    """
+        Vectorized version of pixel2pixel, broadcasting over numpy arrays.
+        :param pixel_x: Pixel X coordinates.
+        :param pixel_y: Pixel Y coordinates.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param new_level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :return: The pixel coordinates in pixels.
+    """
+    map_size_ = get_map_size(np.asarray(level_of_detail))
+    new_map_size_ = get_map_size(np.asarray(new_level_of_detail))
+    x = (np.asarray(pixel_x, dtype=np.float64) - 0.5) / map_size_
+    y = (np.asarray(pixel_y, dtype=np.float64) - 0.5) / map_size_
+    new_pixel_x = np.clip(x * new_map_size_ + 0.5, 0, new_map_size_ - 1)
+    new_pixel_y = np.clip(y * new_map_size_ + 0.5, 0, new_map_size_ - 1)
+    return new_pixel_x, new_pixel_y, new_level_of_detail
+
+
+def tile2tile_np(tile_x, tile_y, level_of_detail, new_level_of_detail):
+    """
+        Vectorized version of tile2tile, broadcasting over numpy arrays.
+        :param tile_x: Tile X coordinates.
+        :param tile_y: Tile Y coordinates.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param new_level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :return: The tile X and Y coordinates.
+    """
+    pixel = tile2pixel(np.asarray(tile_x), np.asarray(tile_y), level_of_detail)
+    new_pixel = pixel2pixel_np(*pixel, new_level_of_detail)
+    return pixel2tile(*new_pixel)
+
+
+def tile2geodetic_np(tile_x, tile_y, level_of_detail, exact=True):
+    """
+        Vectorized version of tile2geodetic, broadcasting over numpy arrays.
+        :param tile_x: Tile X coordinates.
+        :param tile_y: Tile Y coordinates.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param exact: Match the scalar function bit-for-bit instead of using the numpy ufuncs.
+        :return: The latitudes and longitudes of the upper-left corners in degrees.
+    """
+    pixel = tile2pixel(np.asarray(tile_x), np.asarray(tile_y), level_of_detail)
+    return pixel2geodetic_np(*pixel, exact=exact)
+
+
+def geodetic2tile_np(latitude, longitude, level_of_detail, exact=True):
+    """
+        Vectorized version of geodetic2tile, broadcasting over numpy arrays.
+        :param latitude: Latitudes of the points, in degrees.
+        :param longitude: Longitudes of the points, in degrees.
+        :param level_of_detail: Level of detail, from 1 (lowest detail) to 23 (highest detail).
+        :param exact: Match the scalar function bit-for-bit instead of using the numpy ufuncs.
+        :return: The tile X and Y coordinates.
+    """
+    pixel = geodetic2pixel_np(latitude, longitude, level_of_detail, exact=exact)
+    return pixel2tile(*pixel)
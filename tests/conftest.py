@@ -0,0 +1,21 @@
+import pytest
+
+from bingtiles.provider import default_google_versions
+from bingtiles.testing import TileServer
+
+
+@pytest.fixture
+def tile_server():
+    server = TileServer(format='png', distinct=True)
+    yield server
+    server.close()
+
+
+@pytest.fixture(autouse=True)
+def google_versions(monkeypatch):
+    # Google URLs are built with the default versions, without discovering them over the network
+    # or reading and writing the user's cache
+    monkeypatch.setattr(default_google_versions, 'background', False)
+    monkeypatch.setattr(default_google_versions, 'path', None)
+    monkeypatch.setattr(default_google_versions, 'versions', {})
+    monkeypatch.setattr(default_google_versions, 'fetched', 0.0)
@@ -0,0 +1,82 @@
+import os
+import asyncio
+
+import numpy as np
+import pytest
+
+from bingtiles import asyncfetch, AsyncFetcher, CachedFetcher, MapGenerator, MemoryCache, NegativeCache
+from bingtiles.testing import tile_content
+from bingtiles.provider import providers
+
+
+@pytest.fixture(params=['aiohttp', 'threaded'])
+def backend(request, monkeypatch):
+    if request.param == 'aiohttp' and asyncfetch.aiohttp is None:
+        pytest.skip('aiohttp is not installed')
+    if request.param == 'threaded':
+        monkeypatch.setattr(asyncfetch, 'aiohttp', None)
+    return request.param
+
+
+def fetch_many(poses, provider, **kwargs):
+    async def run():
+        async with AsyncFetcher(provider, memory_cache=MemoryCache(), negative_cache=NegativeCache(),
+                                **kwargs) as fetcher:
+            return await fetcher.fetch_many(poses, as_array=True)
+
+    return asyncio.run(run())
+
+
+def test_per_host_limit(tile_server, backend):
+    tile_server.latency = 0.05
+    hosts = ('127.0.0.1', 'localhost')
+    provider = tile_server.provider(providers['bing_aerial'], hosts)
+    poses = np.array([(x, y, 5) for x in range(4) for y in range(6)])
+    tiles = fetch_many(poses, provider, per_host=3)
+    assert all(tile.shape == (256, 256, 3) for tile in tiles)
+    assert sum(tile_server.requests.values()) == len(poses)
+    assert len(tile_server.max_in_flight) == len(hosts)
+    assert set(tile_server.max_in_flight.values()) == {3}
+
+
+def test_total_limit(tile_server, backend):
+    tile_server.latency = 0.05
+    provider = tile_server.provider(providers['esri_aerial'], ('127.0.0.1', 'localhost'))
+    fetch_many([(x, 0, 4) for x in range(12)], provider, per_host=8, limit=2)
+    assert tile_server.max_total == 2
+
+
+def test_cache_write_through(tile_server, backend, tmp_path):
+    provider = tile_server.provider(providers['esri_aerial'])
+    cache_path = str(tmp_path / 'cache')
+    poses = np.array([(x, y, 6) for x in range(3) for y in range(2)])
+    with CachedFetcher(cache_path, provider, raw=True, layout='sharded', memory_cache=MemoryCache()) as cache:
+        tiles = fetch_many(poses, provider, cache=cache)
+    assert sum(tile_server.requests.values()) == len(poses)
+    with CachedFetcher(cache_path, provider, memory_cache=MemoryCache()) as cache:
+        for (x, y, z), tile in zip(poses.tolist(), tiles):
+            assert os.path.exists(os.path.join(cache_path, provider.__name__, str(z), str(x), f'{y}.png'))
+            content, content_type = cache.get_raw((x, y, z))
+            assert content_type == 'image/png'
+            assert content == tile_content(provider((x, y, z)).split(str(tile_server.port), 1)[1])
+            assert np.array_equal(cache((x, y, z), only_cached=True, as_array=True), tile)
+        fetch_many(poses, provider, cache=cache)
+    assert sum(tile_server.requests.values()) == len(poses)
+
+
+@pytest.mark.parametrize('name', ['bing_aerial', 'esri_aerial', 'google_satellite'])
+def test_agenerate_map(tile_server, backend, name):
+    provider = tile_server.provider(providers[name])
+    geo1, geo2, lod = (41.02, 28.96), (41.00, 28.99), 14
+    with CachedFetcher(provider=provider, memory_cache=MemoryCache()) as fetcher:
+        expected = MapGenerator(provider, fetcher, parallel=False).generate_map(geo1, geo2, lod, as_array=True)
+    requests = sum(tile_server.requests.values())
+
+    async def run():
+        async with AsyncFetcher(provider, memory_cache=MemoryCache()) as fetcher:
+            return await MapGenerator(provider, fetcher, parallel=False).agenerate_map(geo1, geo2, lod, as_array=True)
+
+    image = asyncio.run(run())
+    assert sum(tile_server.requests.values()) == 2 * requests
+    assert image.shape == expected.shape
+    assert np.array_equal(image, expected)
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from bingtiles import CachedFetcher, MemoryCache, NegativeCache, RetryPolicy, SingleFlight, fetch_tile
+from bingtiles.provider import providers
+
+LAYOUTS = {'flat': 'flat', 'sharded': 'sharded', 'sqlite': 'cache.mbtiles'}
+CALLERS = 8
+
+
+def concurrently(func):
+    # every caller starts at once, the server latency keeps the first request open until all have asked
+    barrier = threading.Barrier(CALLERS)
+    results = [None] * CALLERS
+
+    def call(i):
+        barrier.wait()
+        try:
+            results[i] = func()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('raw', [False, True])
+def test_one_request(tile_server, tmp_path, layout, raw):
+    tile_server.latency = 0.2
+    provider = tile_server.provider(providers['bing_aerial'])
+    with CachedFetcher(str(tmp_path / LAYOUTS[layout]), provider, layout=layout, raw=raw,
+                       memory_cache=MemoryCache(), single_flight=SingleFlight()) as fetcher:
+        results = concurrently(lambda: fetcher((1, 2, 3), as_array=True))
+        assert sum(tile_server.requests.values()) == 1
+        for result in results:
+            assert np.array_equal(result, results[0])
+
+
+def test_one_request_uncached(tile_server):
+    tile_server.latency = 0.2
+    provider = tile_server.provider(providers['bing_aerial'])
+    single_flight = SingleFlight()
+    concurrently(lambda: fetch_tile((1, 2, 3), provider, memory_cache=MemoryCache(), single_flight=single_flight))
+    assert sum(tile_server.requests.values()) == 1
+    assert single_flight.coalesced == CALLERS - 1
+    assert len(single_flight) == 0
+
+
+def test_error_reaches_waiters(tile_server, tmp_path):
+    tile_server.latency = 0.2
+    tile_server.error_rate = 1.0
+    provider = tile_server.provider(providers['bing_aerial'])
+    with CachedFetcher(str(tmp_path / 'cache'), provider, layout='sharded', memory_cache=MemoryCache(),
+                       single_flight=SingleFlight(), negative_cache=NegativeCache(),
+                       retry_policy=RetryPolicy(0)) as fetcher:
+        results = concurrently(lambda: fetcher((1, 2, 3), as_array=True))
+    assert sum(tile_server.requests.values()) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_leader_error_shared():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fail():
+        started.set()
+        release.wait()
+        raise KeyError('tile')
+
+    def call():
+        try:
+            single_flight.do('key', fail)
+        except KeyError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(CALLERS)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while single_flight.coalesced < CALLERS - 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    # every caller gets the exception of the one call
+    assert len(errors) == CALLERS
+    assert all(error is errors[0] for error in errors)
+    assert len(single_flight) == 0
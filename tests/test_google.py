@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+from bingtiles.provider import google
+from bingtiles.provider.google import GoogleVersions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+API_JS = ('"https://mt0.googleapis.com/vt?lyrs=m@400000000&hl=en" '
+          '"https://khm0.googleapis.com/kh?v=950&hl=en" '
+          '"https://mt0.googleapis.com/vt?lyrs=t@400,r@400000000&hl=en"')
+
+
+@pytest.fixture
+def api_js(monkeypatch):
+    calls = []
+
+    def get_api_js(timeout=10):
+        calls.append(time.time())
+        return API_JS
+
+    monkeypatch.setattr(google, 'get_api_js', get_api_js)
+    return calls
+
+
+def wait(versions):
+    if versions.thread is not None:
+        versions.thread.join()
+
+
+def save(versions, satellite, fetched):
+    versions.versions = {'satellite': satellite}
+    versions.fetched = fetched
+    versions.save()
+    # a later mtime, as the file system may not tell writes within one tick apart
+    mtime = os.stat(versions.path).st_mtime_ns + 10 ** 9 * int(satellite)
+    os.utime(versions.path, ns=(mtime, mtime))
+
+
+def test_refresh_and_reload(tmp_path, api_js):
+    path = str(tmp_path / 'google_versions.json')
+    versions = GoogleVersions(path, background=False)
+    assert versions.get('satellite') is None
+    assert versions.refresh() == {'map': 'm@400000000', 'satellite': '950', 'terrain': 't@400,r@400000000'}
+    # another process picks up the file on its next check
+    other = GoogleVersions(path, background=False, check_interval=0)
+    assert other.get('satellite') == '950'
+    save(versions, '951', versions.fetched + 1)
+    assert other.get('satellite') == '951'
+    # an older file does not replace newer versions
+    save(versions, '952', versions.fetched - 10)
+    assert other.get('satellite') == '951'
+
+
+def test_ttl(tmp_path, api_js):
+    path = str(tmp_path / 'google_versions.json')
+    versions = GoogleVersions(path, ttl=60, check_interval=0)
+    assert versions.get('satellite') is None
+    wait(versions)
+    assert len(api_js) == 1
+    assert versions.get('satellite') == '950'
+    wait(versions)
+    assert len(api_js) == 1
+    versions.fetched -= 120
+    versions.versions = {'satellite': '949'}
+    versions.get('satellite')
+    wait(versions)
+    assert len(api_js) == 2
+    assert versions.get('satellite') == '950'
+
+
+def test_failed_refresh_retried_later(tmp_path, monkeypatch):
+    def get_api_js(timeout=10):
+        raise OSError('offline')
+
+    monkeypatch.setattr(google, 'get_api_js', get_api_js)
+    versions = GoogleVersions(str(tmp_path / 'google_versions.json'), retry_interval=60, check_interval=0)
+    versions.get('satellite')
+    wait(versions)
+    assert versions.retry_at > time.time() + 30
+    thread = versions.thread
+    versions.get('satellite')
+    assert versions.thread is thread
+
+
+def test_lock(tmp_path, api_js):
+    path = str(tmp_path / 'google_versions.json')
+    lock = google._claim(path + '.lock')
+    assert lock is not None
+    assert google._claim(path + '.lock') is None
+    # while another refresh holds the lock the versions are not downloaded
+    versions = GoogleVersions(path, check_interval=0)
+    versions.get('satellite')
+    wait(versions)
+    assert api_js == []
+    assert versions.retry_at > 0
+    lock.close()
+    versions.retry_at = 0
+    versions.get('satellite')
+    wait(versions)
+    assert len(api_js) == 1
+
+
+def test_lock_released_on_exit(tmp_path):
+    path = str(tmp_path / 'google_versions.json.lock')
+    # the process exits without closing the lock, as a killed refresh thread would leave it
+    code = f'import os\nfrom bingtiles.provider.google import _claim\nassert _claim({path!r})\nos._exit(0)'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    lock = google._claim(path)
+    assert lock is not None
+    lock.close()
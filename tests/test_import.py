@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from bingtiles.testing import HEAVY_MODULES, IMPORT_CASES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# microseconds `import bingtiles` may take, cumulative over the modules it imports
+BUDGET = 50000
+
+
+def run(*args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, check=True)
+
+
+def test_import_time():
+    stderr = run('-X', 'importtime', '-c', 'import bingtiles').stderr
+    # lines are "import time: self [us] | cumulative | imported package", nested ones indented
+    times = [int(line.split('|')[1]) for line in stderr.splitlines() if line.split('|')[-1] == ' bingtiles']
+    assert len(times) == 1
+    assert times[0] < BUDGET
+
+
+@pytest.mark.parametrize('name', IMPORT_CASES)
+def test_heavy_modules(name):
+    statement, allowed = IMPORT_CASES[name]
+    check = f'{statement}\nimport sys, json\nprint(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))'
+    modules = json.loads(run('-c', check).stdout.splitlines()[-1])
+    assert [m for m in modules if m not in allowed] == []
+
+
+def test_exports_not_shadowed():
+    # importing a submodule binds it on the package, an export of the same name would then be the module
+    import types
+    import importlib
+    import bingtiles
+    for module in bingtiles._modules:
+        importlib.import_module(f'bingtiles.{module}')
+    shadowed = [name for name in bingtiles._exports if isinstance(getattr(bingtiles, name), types.ModuleType)]
+    assert shadowed == []
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from bingtiles import (mapgen, generate_map, stream_map, iter_split_map, split_map, store_map, calculate_coverage,
+                       CachedFetcher, MemoryCache)
+from bingtiles.fetch import decode_image
+from bingtiles.provider import providers
+from bingtiles.storage import ShardedStorage, SQLiteStorage
+
+AREAS = [((41.02, 28.96), (41.00, 28.99), 14), ((41.021, 28.961), (41.00, 28.99), 15)]
+
+
+def map_size(geo1, geo2, lod):
+    tile_mn, tile_mx, tile_mn_frac, tile_mx_frac = calculate_coverage(geo1, geo2, lod)
+    return tuple((256 * (tile_mx - tile_mn) + tile_mx_frac - tile_mn_frac).tolist())
+
+
+def padded_split(image, geo1, geo2, lod):
+    # the former split_map: the image pasted into a zeroed mosaic of whole tiles, which is then cut up
+    tile_mn, tile_mx, tile_mn_frac, _ = calculate_coverage(geo1, geo2, lod)
+    columns, rows = (tile_mx - tile_mn + 1).tolist()
+    padded = np.zeros((256 * rows, 256 * columns) + image.shape[2:], dtype=image.dtype)
+    padded[tile_mn_frac[1]:tile_mn_frac[1] + image.shape[0], tile_mn_frac[0]:tile_mn_frac[0] + image.shape[1]] = image
+    return {(x, y): padded[256 * (y - tile_mn[1]):256 * (y - tile_mn[1] + 1),
+                           256 * (x - tile_mn[0]):256 * (x - tile_mn[0] + 1)]
+            for y in range(tile_mn[1], tile_mx[1] + 1) for x in range(tile_mn[0], tile_mx[0] + 1)}
+
+
+def random_image(size, channels):
+    shape = size[::-1] + ((channels,) if channels != 1 else ())
+    return np.random.default_rng(0).integers(1, 256, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize('geo1, geo2, lod', AREAS)
+@pytest.mark.parametrize('channels', [1, 3, 4])
+def test_iter_split_map(geo1, geo2, lod, channels):
+    image = random_image(map_size(geo1, geo2, lod), channels)
+    expected = padded_split(image, geo1, geo2, lod)
+    tiles = list(iter_split_map(image, geo1, geo2, lod, as_array=True))
+    assert sorted(tuple(pos[:2].tolist()) for pos, _ in tiles) == sorted(expected)
+    for pos, tile in tiles:
+        assert tile.shape == (256, 256) + image.shape[2:]
+        assert np.array_equal(tile, expected[tuple(pos[:2].tolist())])
+    # the border tiles are padded, the others are views of the image
+    assert sum(np.shares_memory(tile, image) for _, tile in tiles) == sum(
+        tile.all() for tile in expected.values())
+    pos, tile = split_map(Image.fromarray(image), geo1, geo2, lod)[0]
+    assert np.array_equal(np.asarray(tile), tiles[0][1])
+
+
+@pytest.mark.parametrize('channels', [1, 3])
+def test_iter_split_map_resize(monkeypatch, channels):
+    geo1, geo2, lod = AREAS[0]
+    size = map_size(geo1, geo2, lod)
+    image = random_image((size[0] // 2, size[1] // 2), channels)
+    monkeypatch.setattr(mapgen, 'load_cv2', lambda: None)
+    expected = padded_split(np.asarray(Image.fromarray(image).resize(size, Image.NEAREST)), geo1, geo2, lod)
+    for pos, tile in iter_split_map(image, geo1, geo2, lod, as_array=True):
+        assert np.array_equal(tile, expected[tuple(pos[:2].tolist())])
+
+
+@pytest.mark.parametrize('target', ['sharded', 'sqlite', 'fetcher'])
+@pytest.mark.parametrize('channels', [3, 4])
+def test_store_map(tmp_path, target, channels):
+    geo1, geo2, lod = AREAS[1]
+    image = random_image(map_size(geo1, geo2, lod), channels)
+    if target == 'sharded':
+        storage = fetcher = ShardedStorage(str(tmp_path / 'cache'))
+    elif target == 'sqlite':
+        storage = fetcher = SQLiteStorage(str(tmp_path / 'cache.mbtiles'))
+    else:
+        fetcher = CachedFetcher(str(tmp_path / 'cache'), layout='sharded', memory_cache=MemoryCache())
+        storage = fetcher.storage
+    tiles = list(iter_split_map(image, geo1, geo2, lod, as_array=True))
+    if target == 'fetcher':
+        # a tile already decoded into the memory cache is replaced too
+        fetcher.store_raw(tuple(tiles[0][0].tolist()), mapgen._encode(tiles[1][1], 'png'), 'image/png', 'processed')
+        assert np.array_equal(fetcher(tiles[0][0], 'processed', as_array=True), tiles[1][1])
+    assert store_map(image, geo1, geo2, fetcher, 'processed', lod, workers=4) == len(tiles)
+    for pos, tile in tiles:
+        content, content_type = storage.get(storage.key('processed', tuple(pos.tolist())))
+        assert content_type == 'image/png'
+        assert np.array_equal(decode_image(content), tile)
+    if target == 'fetcher':
+        assert np.array_equal(fetcher(tiles[0][0], 'processed', as_array=True), tiles[0][1])
+    fetcher.close()
+
+
+def test_store_map_flat_layout(tmp_path):
+    geo1, geo2, lod = AREAS[0]
+    with CachedFetcher(str(tmp_path / 'cache'), layout='flat', memory_cache=MemoryCache()) as fetcher:
+        with pytest.raises(ValueError):
+            store_map(random_image(map_size(geo1, geo2, lod), 3), geo1, geo2, fetcher, 'processed', lod)
+
+
+@pytest.mark.parametrize('first', [None, 1, 4])
+def test_generate_map_decode_workers(tile_server, tmp_path, first):
+    geo1, geo2, lod = AREAS[1]
+    provider = tile_server.provider(providers['bing_aerial'])
+    with CachedFetcher(str(tmp_path / 'cache'), provider, layout='sharded', raw=True) as fetcher:
+        poses = mapgen._tile_grid(*calculate_coverage(geo1, geo2, lod)[:2], lod).tolist()
+        # the mosaic takes the channels of the first tile, later tiles with more are pasted after converting it
+        for pos, channels in [(poses[0], first), (poses[-1], 4)]:
+            if channels is not None:
+                tile = random_image((256, 256), channels)
+                fetcher.store_raw(tuple(pos), mapgen._encode(tile, 'png'), 'image/png')
+        expected = generate_map(geo1, geo2, lod, provider, fetcher=fetcher, as_array=True)
+        for parallel in (False, True):
+            image = generate_map(geo1, geo2, lod, provider, parallel=parallel, as_array=True, fetcher=fetcher,
+                                 decode_workers=2)
+            assert image.shape == expected.shape == map_size(geo1, geo2, lod)[::-1] + (4,)
+            assert np.array_equal(image, expected)
+
+
+@pytest.mark.parametrize('lod', [14, 15, 16])
+@pytest.mark.parametrize('strip_rows', [1, 2, 5])
+def test_stream_map(tile_server, tmp_path, lod, strip_rows):
+    geo1, geo2, _ = AREAS[1]
+    provider = tile_server.provider(providers['bing_aerial'])
+    with CachedFetcher(str(tmp_path / 'cache'), provider, layout='sharded') as fetcher:
+        expected = generate_map(geo1, geo2, lod, provider, fetcher=fetcher, as_array=True)
+        path = str(tmp_path / 'map.npy')
+        image = stream_map(geo1, geo2, path, lod, provider, fetcher=fetcher, strip_rows=strip_rows)
+        assert np.array_equal(image, expected)
+        assert np.array_equal(np.load(path), expected)
@@ -0,0 +1,57 @@
+import gc
+import weakref
+
+import numpy as np
+
+from bingtiles import MemoryCache, CachedFetcher, default_memory_cache
+from bingtiles.testing import tile_content
+from bingtiles.provider import providers
+
+
+def test_writable_copies():
+    cache = MemoryCache()
+    tile = np.zeros((256, 256, 3), np.uint8)
+    cache.put('tile', tile)
+    tile[:] = 1
+    assert tile.flags.writeable
+    copy = cache.get('tile')
+    assert copy.flags.writeable and not copy.any()
+    copy[:] = 2
+    assert not cache.get('tile').any()
+
+
+def test_readonly():
+    cache = MemoryCache(readonly=True)
+    tile = np.zeros((256, 256, 3), np.uint8)
+    cache.put('tile', tile)
+    assert cache.get('tile') is tile
+    assert not tile.flags.writeable
+
+
+def test_byte_bound():
+    cache = MemoryCache(max_bytes=3 * 256 * 256)
+    for i in range(5):
+        cache.put(i, np.zeros((256, 256), np.uint8))
+    assert list(cache.items) == [2, 3, 4]
+    assert cache.stats()['evictions'] == 2
+
+
+def test_fetcher_tiles_are_writable(tmp_path):
+    provider = providers['esri_aerial']
+    with CachedFetcher(str(tmp_path / 'cache'), provider, memory_cache=MemoryCache()) as fetcher:
+        fetcher.store_raw((0, 0, 1), tile_content('tile'), 'image/png')
+        tile = fetcher((0, 0, 1), as_array=True)
+        tile[:] = 0
+        assert fetcher((0, 0, 1), as_array=True).any()
+
+
+def test_closed_storage_released(tmp_path):
+    fetcher = CachedFetcher(str(tmp_path / 'cache'), providers['esri_aerial'])
+    fetcher.store_raw((0, 0, 1), tile_content('tile'), 'image/png')
+    fetcher((0, 0, 1))
+    storage = weakref.ref(fetcher.storage)
+    assert any(key[0] is storage() for key in default_memory_cache.items)
+    fetcher.close()
+    del fetcher
+    gc.collect()
+    assert storage() is None
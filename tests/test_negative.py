@@ -0,0 +1,88 @@
+import json
+import hashlib
+
+import pytest
+
+from bingtiles import negative, NegativeCache, BING_NO_TILE
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1e9
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(negative, 'time', clock)
+    return clock
+
+
+def test_classify():
+    cache = NegativeCache()
+    assert cache.classify(404, b'') == 404
+    assert cache.classify(200, b'') == 204
+    # placeholders are proper tiles unless their detection is asked for
+    assert cache.classify(200, b'tile', BING_NO_TILE) is None
+    assert NegativeCache(placeholder_headers=BING_NO_TILE).classify(200, b'tile', BING_NO_TILE) == 'placeholder'
+    assert NegativeCache(placeholder_headers=BING_NO_TILE).classify(200, b'tile', {}) is None
+    cache = NegativeCache(placeholders=[hashlib.sha256(b'empty').hexdigest()])
+    assert cache.classify(200, b'empty') == 'placeholder'
+    assert cache.classify(200, b'tile') is None
+
+
+def test_ttls(clock):
+    cache = NegativeCache(ttls={404: 100, 500: 0}, default_ttl=10)
+    cache.put('a', 404)
+    cache.put('b', 503)
+    cache.put('c', 500)
+    cache.put('d', 'placeholder')
+    cache.put('e', 503, ttl=1000)
+    assert [cache.get(key) for key in 'abcde'] == [404, 503, None, 'placeholder', 503]
+    clock.now += 50
+    assert [key in cache for key in 'abcde'] == [True, False, False, True, True]
+    clock.now += 100
+    assert [key in cache for key in 'abcde'] == [False, False, False, True, True]
+    clock.now += negative.DEFAULT_TTLS['placeholder']
+    assert [key in cache for key in 'abcde'] == [False] * 5
+
+
+def test_persistence(tmp_path, clock):
+    path = str(tmp_path / 'negative')
+    cache = NegativeCache(path, ttls={404: 100})
+    cache.put(('google_map', 3, 1, 2), 404)
+    cache.put('url', 410)
+    cache.close()
+    cache = NegativeCache(path, ttls={404: 100})
+    assert cache.get(('google_map', 3, 1, 2)) == 404
+    assert cache.get('url') == 410
+    cache.put('url', 404)
+    cache.close()
+    clock.now += 200
+    cache = NegativeCache(path)
+    assert cache.get(('google_map', 3, 1, 2)) is None
+    # the later entry replaces the earlier one
+    assert cache.get('url') is None
+    cache.close()
+
+
+def test_compaction(tmp_path, clock):
+    path = str(tmp_path / 'negative')
+    cache = NegativeCache(path, ttls={404: 100})
+    for i in range(10):
+        cache.put(f'short{i}', 404)
+    cache.put('long', 410)
+    cache.close()
+    with open(path) as f:
+        assert len(f.readlines()) == 11
+    clock.now += 200
+    cache = NegativeCache(path)
+    # the file is rewritten with the live entries once most of its lines are expired or superseded
+    with open(path) as f:
+        assert [json.loads(line)[0] for line in f] == ['long']
+    cache.put('new', 404)
+    cache.close()
+    assert set(NegativeCache(path).entries) == {'long', 'new'}
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from bingtiles.provider import providers, provider_urls, provider_name, parse_url
+
+
+def grid(lod, size=6):
+    n = 1 << lod
+    xs = np.unique(np.linspace(0, n - 1, min(n, size)).astype(np.int64))
+    return np.array([(x, y, lod) for x in xs for y in xs], dtype=np.int64)
+
+
+@pytest.mark.parametrize('name', list(providers))
+@pytest.mark.parametrize('lod', [1, 2, 9, 17, 23])
+def test_batch_urls(name, lod):
+    provider = providers[name]
+    poses = grid(lod)
+    assert provider_urls(provider, poses) == [provider(tuple(pos)) for pos in poses.tolist()]
+    assert provider_urls(provider, [tuple(pos) for pos in poses.tolist()]) == provider_urls(provider, poses)
+
+
+def test_batch_urls_unregistered():
+    provider = lambda pos: 'http://localhost/{}/{}/{}'.format(*pos)
+    assert provider_urls(provider, grid(3)) == [provider(tuple(pos)) for pos in grid(3).tolist()]
+
+
+@pytest.mark.parametrize('name', list(providers))
+def test_parse_url(name):
+    pos = (1234, 567, 13)
+    assert parse_url(providers[name](pos)) == (name, pos)
+    assert provider_name(providers[name]) == name
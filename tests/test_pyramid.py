@@ -0,0 +1,25 @@
+import numpy as np
+
+from bingtiles import MapGenerator, CachedFetcher, FallbackFetcher, generate_map
+from bingtiles.provider import providers
+
+AREA = ((41.02, 28.96), (41.00, 28.99))
+
+
+def test_refine_reused_generator(tile_server, tmp_path):
+    provider = tile_server.provider(providers['bing_aerial'])
+    with CachedFetcher(str(tmp_path / 'cache'), provider, layout='sharded') as fetcher:
+        # only the level above is cached, the tiles of the map are upscaled from it
+        generate_map(*AREA, 14, provider, fetcher=fetcher)
+        fallback = FallbackFetcher(fetcher, only_cached=True)
+        generator = MapGenerator(provider, fallback)
+        try:
+            rough = generator.generate_map(*AREA, 15, as_array=True)
+            assert fallback.synthetic
+            assert fallback.refine() == set()
+            refined = generator.generate_map(*AREA, 15, as_array=True)
+        finally:
+            generator.close()
+        expected = generate_map(*AREA, 15, provider, fetcher=fetcher, as_array=True)
+        assert not np.array_equal(rough, expected)
+        assert np.array_equal(refined, expected)
@@ -0,0 +1,106 @@
+import time
+import heapq
+import threading
+
+import pytest
+
+from bingtiles import CacheQuota, SQLiteStorage, TileStorage
+from bingtiles import quota as quota_module
+from bingtiles.testing import tile_content
+
+
+class NullStorage(TileStorage):
+    def __init__(self):
+        self.deleted = []
+
+    def entries(self):
+        return iter(())
+
+    def delete_many(self, keys):
+        self.deleted.extend(keys)
+
+
+class TrackedLock:
+    # tells whether the lock is held, and by which thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owner = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.owner = threading.get_ident()
+
+    def __exit__(self, *args):
+        self.owner = None
+        self.lock.release()
+
+
+class SelectionSpy:
+    # stands in for the heapq module of the quota, recording whether the lock was held for each call
+    def __init__(self, lock):
+        self.lock = lock
+        self.calls = []
+
+    def __getattr__(self, name):
+        func = getattr(heapq, name)
+
+        def call(*args, **kwargs):
+            self.calls.append((name, self.lock.owner == threading.get_ident()))
+            return func(*args, **kwargs)
+
+        return call
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('policy', ['lru', 'lfu'])
+def test_eviction_order(policy):
+    storage = NullStorage()
+    quota = CacheQuota(storage, max_tiles=100, policy=policy, low_water=0.5, interval=60)
+    for i in range(100):
+        quota.add(i, 10)
+    for i in range(50):
+        quota.touch(i)
+    quota.max_tiles = 99
+    quota.evict()
+    quota.close()
+    # the 50 untouched tiles are the least recently and the least frequently used, then the first touched one
+    assert sorted(storage.deleted) == [0, *range(50, 100)]
+    assert quota.stats()['tiles'] == 49
+
+
+@pytest.mark.parametrize('policy', ['lru', 'lfu'])
+def test_lock_not_held_while_selecting(monkeypatch, policy):
+    storage = NullStorage()
+    quota = CacheQuota(storage, max_tiles=10 ** 6, policy=policy, interval=60)
+    for i in range(20000):
+        quota.add(i, 10)
+    quota.lock = TrackedLock()
+    spy = SelectionSpy(quota.lock)
+    monkeypatch.setattr(quota_module, 'heapq', spy)
+    quota.max_tiles = 19900
+    quota.evict()
+    quota.close()
+    assert len(storage.deleted) == 20000 - int(19900 * quota.low_water)
+    # victims are picked without holding up the fetch threads adding and touching tiles
+    assert spy.calls
+    assert [name for name, locked in spy.calls if locked] == []
+
+
+def test_sqlite_access_times_after_restart(tmp_path):
+    path = str(tmp_path / 'cache.mbtiles')
+    with SQLiteStorage(path) as storage:
+        for x in range(10):
+            # tiles fetched in the order 9, 8, ..., 0
+            storage.put(('p', 4, x, 0), tile_content(str(x)), 'image/png', {'fetched': 1000.0 - x})
+    with SQLiteStorage(path) as storage:
+        assert sorted(accessed for _, _, accessed in storage.entries()) == [991.0 + x for x in range(10)]
+        quota = CacheQuota(storage, max_tiles=8, low_water=0.5)
+        wait_for(lambda: quota.stats()['tiles'] == 4)
+        quota.close()
+        assert sorted(key[2] for key, _, _ in storage.entries()) == [0, 1, 2, 3]
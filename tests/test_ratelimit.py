@@ -0,0 +1,18 @@
+from bingtiles import RateLimiter, provider_rate_limiter
+from bingtiles.provider import providers
+
+
+def test_provider_rate_is_shared_by_its_servers():
+    provider = providers['bing_aerial']
+    urls = [provider((x, 0, 3)) for x in range(8)]
+    assert len({url.split('/')[2] for url in urls}) == 4
+    limiter = provider_rate_limiter(provider, 4)
+    assert [round(limiter.acquire(url), 2) for url in urls] == [0, 0, 0, 0, 0.25, 0.5, 0.75, 1.0]
+    # a plain per-host limiter lets each server take its own burst
+    limiter = RateLimiter(4)
+    assert max(limiter.acquire(url) for url in urls) <= 0.25
+
+
+def test_provider_rate_without_common_domain():
+    limiter = provider_rate_limiter(lambda pos: f'http://{"a.org" if pos[0] % 2 else "b.net"}/tile', 4)
+    assert limiter.rate == 2
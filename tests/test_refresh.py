@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from bingtiles import CachedFetcher, MemoryCache
+from bingtiles.fetch import decode_image
+from bingtiles.provider import providers
+
+LAYOUTS = {'flat': 'flat', 'sharded': 'sharded', 'sqlite': 'cache.mbtiles'}
+POS = (1, 2, 3)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('raw', [False, True])
+def test_refresh(tile_server, tmp_path, layout, raw):
+    provider = tile_server.provider(providers['bing_aerial'])
+    path = provider(POS).split(str(tile_server.port), 1)[1]
+    with CachedFetcher(str(tmp_path / LAYOUTS[layout]), provider, layout=layout, raw=raw,
+                       memory_cache=MemoryCache()) as fetcher:
+        key = fetcher.key(POS)
+        fetcher(POS, as_array=True)
+        meta = fetcher.storage.get_meta(key)
+        assert meta['etag'] and meta['last_modified']
+
+        # the validators are sent and the 304 leaves the tile as it is
+        assert fetcher.refresh(POS) == 'unchanged'
+        assert tile_server.not_modified == 1
+        refreshed = fetcher.storage.get_meta(key)
+        # the 304 only has the ETag, the Last-Modified of the tile is kept
+        assert refreshed['etag'] == meta['etag']
+        assert refreshed['last_modified'] == meta['last_modified']
+        assert refreshed['fetched'] >= meta['fetched']
+        requests = sum(tile_server.requests.values())
+        assert fetcher.refresh(POS, max_age=60) == 'fresh'
+        assert sum(tile_server.requests.values()) == requests
+
+        # a server without validators sends the tile again, which is not rewritten as its bytes are the same
+        tile_server.validators = False
+        content = fetcher.storage.get(key)[0]
+        assert fetcher.refresh(POS) == 'unchanged'
+        assert tile_server.not_modified == 1
+        assert fetcher.storage.get(key)[0] == content
+        tile_server.validators = True
+
+        tile_server.revision = 1
+        assert fetcher.refresh(POS) == 'changed'
+        expected = decode_image(tile_server.content(path))
+        assert np.array_equal(decode_image(fetcher.storage.get(key)[0]), expected)
+        assert fetcher.storage.get_meta(key)['etag'] != meta['etag']
+        assert np.array_equal(fetcher(POS, as_array=True), expected)
+        assert fetcher.refresh(POS) == 'unchanged'
+        assert tile_server.not_modified == 2
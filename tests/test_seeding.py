@@ -0,0 +1,70 @@
+import os
+import json
+
+import pytest
+
+from bingtiles import CachedFetcher, MemoryCache, RetryPolicy, seed, read_bboxes
+from bingtiles.provider import providers
+
+BBOX = ((41.02, 28.96), (41.00, 28.99))
+
+
+def open_fetcher(tmp_path, provider):
+    return CachedFetcher(str(tmp_path / 'cache'), provider, raw=True, layout='sharded', memory_cache=MemoryCache(),
+                         retry_policy=RetryPolicy(0))
+
+
+def unreachable(pos):
+    # nothing listens on the discard port, the connection is refused
+    return 'http://127.0.0.1:9/{}/{}/{}'.format(*pos)
+
+
+def test_connection_errors_are_counted(tmp_path):
+    with open_fetcher(tmp_path, unreachable) as fetcher:
+        stats = seed(fetcher, [BBOX], 13, 14, workers=4)
+    assert stats['tiles'] == 6
+    assert stats['failed'] == 6
+    assert stats['fetched'] == 0
+    assert stats['tiles_per_second'] == 0
+
+
+def test_checkpoint_retries_failed_chunks(tile_server, tmp_path):
+    live = tile_server.provider(providers['esri_aerial'])
+    checkpoint = str(tmp_path / 'seed.json')
+
+    def down(pos):
+        return unreachable(pos)
+
+    # the same provider name, while its server is down
+    down.__name__ = live.__name__
+    with open_fetcher(tmp_path, down) as fetcher:
+        stats = seed(fetcher, [BBOX], 13, 14, workers=4, chunk_size=2, checkpoint=checkpoint)
+    assert stats['failed'] == 6
+    assert not os.path.exists(checkpoint)
+    with open_fetcher(tmp_path, live) as fetcher:
+        stats = seed(fetcher, [BBOX], 13, 14, workers=4, chunk_size=2, checkpoint=checkpoint)
+        assert stats['fetched'] == 6
+        assert stats['tiles_per_second'] > 0
+        stats = seed(fetcher, [BBOX], 13, 14, workers=4, chunk_size=2, checkpoint=checkpoint)
+        assert stats['cached'] == 6
+        # a resumed run that skips every tile downloads nothing
+        assert stats['tiles_per_second'] == 0
+    with open(checkpoint) as f:
+        assert json.load(f)['done'] == ['0:13:0', '0:14:0', '0:14:1']
+
+
+@pytest.mark.parametrize('change', [{'bboxes': [((41.1, 28.9), (41.0, 29.0))]}, {'min_lod': 12}, {'max_lod': 15},
+                                    {'chunk_size': 4}, {'provider': providers['bing_aerial']}])
+def test_checkpoint_of_another_job(tile_server, tmp_path, change):
+    checkpoint = str(tmp_path / 'seed.json')
+    job = {'bboxes': [BBOX], 'min_lod': 13, 'max_lod': 14, 'chunk_size': 2}
+    with open_fetcher(tmp_path, tile_server.provider(providers['esri_aerial'])) as fetcher:
+        seed(fetcher, workers=4, checkpoint=checkpoint, **job)
+        with pytest.raises(ValueError):
+            seed(fetcher, workers=4, checkpoint=checkpoint, **dict(job, **change))
+
+
+def test_read_bboxes(tmp_path):
+    path = tmp_path / 'bboxes.txt'
+    path.write_text('# areas\n41.02 28.96 41.00 28.99\n\n40.1, 29.1, 40.0, 29.2  # second\n')
+    assert read_bboxes(str(path)) == [BBOX, ((40.1, 29.1), (40.0, 29.2))]
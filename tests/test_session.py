@@ -0,0 +1,41 @@
+import threading
+
+from bingtiles import SessionPool
+
+
+def test_resize_replaces_sessions(tile_server):
+    url = f'http://127.0.0.1:{tile_server.port}/tile'
+    with SessionPool(2) as pool:
+        session = pool.session(url)
+        pool.resize(1)
+        assert pool.session(url) is session
+        pool.resize(8)
+        resized = pool.session(url)
+        assert resized is not session
+        assert resized.get_adapter(url)._pool_maxsize == 8
+        assert pool.get(url).status_code == 200
+
+
+def test_resize_while_fetching(tile_server):
+    url = f'http://127.0.0.1:{tile_server.port}/tile'
+    errors = []
+    stop = threading.Event()
+
+    def fetch():
+        try:
+            while not stop.is_set():
+                pool.get(url).raise_for_status()
+        except Exception as e:
+            errors.append(e)
+
+    with SessionPool(1) as pool:
+        threads = [threading.Thread(target=fetch) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for size in range(2, 40):
+            pool.resize(size)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert errors == []
+    assert sum(tile_server.requests.values()) > 0
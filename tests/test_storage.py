@@ -0,0 +1,118 @@
+import os
+import functools
+
+import numpy as np
+import pytest
+
+from bingtiles import CachedFetcher, MemoryCache, SQLiteStorage, seed, build_pyramid, generate_map, migrate_cache
+from bingtiles.testing import tile_content
+from bingtiles.mapgen import calculate_coverage, _tile_grid
+from bingtiles.provider import providers
+
+
+LAYOUTS = {'flat': 'flat', 'sharded': 'sharded', 'sqlite': 'cache.mbtiles'}
+
+GEO1, GEO2, LOD = (41.02, 28.96), (41.00, 28.99), 14
+
+
+def open_fetcher(tmp_path, layout, provider):
+    return CachedFetcher(str(tmp_path / LAYOUTS[layout]), provider, raw=True,
+                         layout=None if layout == 'sqlite' else layout, memory_cache=MemoryCache())
+
+
+def grid(lod):
+    tile_mn, tile_mx, _, _ = calculate_coverage(GEO1, GEO2, lod)
+    return _tile_grid(tile_mn, tile_mx, lod)
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+@pytest.mark.parametrize('name', ['bing_aerial', 'esri_aerial', 'google_satellite'])
+def test_batch_keys(tmp_path, layout, name):
+    with open_fetcher(tmp_path, layout, providers[name]) as fetcher:
+        poses = grid(LOD)
+        expected = [fetcher.key(tuple(pos)) for pos in poses.tolist()]
+        assert fetcher.keys(poses) == expected
+        assert fetcher.storage.keys(fetcher.provider, [tuple(pos) for pos in poses.tolist()]) == expected
+        assert fetcher.keys(poses[:0]) == []
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_keys_passed_through(tile_server, tmp_path, layout):
+    with open_fetcher(tmp_path, layout, tile_server.provider(providers['bing_aerial'])) as fetcher:
+        stats = seed(fetcher, [(GEO1, GEO2)], LOD - 1, LOD, workers=4)
+        poses = np.concatenate([grid(LOD - 1), grid(LOD)])
+        assert stats['fetched'] == len(poses)
+        assert all(fetcher.contains(tuple(pos)) for pos in poses.tolist())
+        written = build_pyramid(fetcher, GEO1, GEO2, LOD, LOD - 2, partial=True, overwrite=True, workers=2)
+        assert written == len(grid(LOD - 1)) + len(grid(LOD - 2))
+        assert all(fetcher.contains(tuple(pos)) for pos in grid(LOD - 2).tolist())
+        requests = sum(tile_server.requests.values())
+        image = generate_map(GEO1, GEO2, LOD, fetcher=fetcher, workers=2, as_array=True)
+        assert sum(tile_server.requests.values()) == requests
+        assert image.ndim == 3 and image.any()
+
+
+@pytest.mark.parametrize('layout', ['sharded', 'sqlite'])
+def test_unnamed_providers_rejected(tmp_path, layout):
+    with open_fetcher(tmp_path, layout, providers['bing_aerial']) as fetcher:
+        storage = fetcher.storage
+        for provider in (lambda pos: 'a', functools.partial(providers['esri_aerial'])):
+            with pytest.raises(ValueError):
+                storage.key(provider, (1, 2, 3))
+            with pytest.raises(ValueError):
+                storage.keys(provider, [(1, 2, 3)])
+
+        def a(pos):
+            return 'a'
+
+        def b(pos):
+            return 'b'
+
+        assert storage.key(a, (1, 2, 3)) != storage.key(b, (1, 2, 3))
+        assert storage.key('a', (1, 2, 3)) == storage.key(a, (1, 2, 3))
+
+
+class FailingFlush(SQLiteStorage):
+    def flush(self):
+        raise OSError('disk full')
+
+
+def flat_cache(tmp_path):
+    source = tmp_path / 'flat'
+    with CachedFetcher(str(source), layout='flat', memory_cache=MemoryCache()) as fetcher:
+        for pos in grid(LOD).tolist():
+            fetcher.store_raw(pos, tile_content(str(pos)), 'image/png', providers['bing_aerial'])
+    return source
+
+
+def test_migrate_remove(tmp_path):
+    source = flat_cache(tmp_path)
+    files = sorted(os.listdir(source))
+    with pytest.raises(OSError):
+        migrate_cache(str(source), FailingFlush(str(tmp_path / 'failing.mbtiles'), batch_size=1000), remove=True)
+    assert sorted(os.listdir(source)) == files
+    destination = SQLiteStorage(str(tmp_path / 'cache.mbtiles'))
+    assert migrate_cache(str(source), destination, remove=True) == (len(files), 0)
+    assert os.listdir(source) == []
+    for pos in grid(LOD).tolist():
+        assert destination.get(destination.key('bing_aerial', pos)) == (tile_content(str(pos)), 'image/png')
+    destination.close()
+
+
+def test_sqlite_contains(tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / 'cache.mbtiles'), batch_size=2)
+    keys = [('bing_aerial', 4, x, 0) for x in range(3)]
+
+    def get(key):
+        raise AssertionError('contains reads the tile')
+
+    monkeypatch.setattr(storage, 'get', get)
+    storage.put(keys[0], tile_content('0'), 'image/png')
+    # pending, then committed
+    assert storage.contains(keys[0])
+    storage.put(keys[1], tile_content('1'), 'image/png')
+    assert not storage.pending
+    assert [storage.contains(key) for key in keys] == [True, True, False]
+    storage.delete(keys[0])
+    assert [storage.contains(key) for key in keys] == [False, True, False]
+    storage.close()